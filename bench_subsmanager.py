@@ -0,0 +1,175 @@
+#!/usr/bin/env python2
+"""bench_subsmanager.py: Measure how fast tail_subsmanager parses a subsmanager logfile"""
+import multiprocessing
+import resource
+import sys
+import time
+
+from tail_subsmanager import parse_lines, read_lines, LineParser, SubsmanagerState, ManagerStatus, LogFollower, create_watcher
+from gen_subsmanager_log import LogGenerator, STYLES, write_log, write_live, size_value
+
+__author__ = "Raido Pahtma"
+__license__ = "MIT"
+
+
+class CountingReader(object):
+
+    def __init__(self, logfile):
+        self.logfile = logfile
+        self.lines = 0
+        self.bytes = 0
+
+    def __iter__(self):
+        for line in self.logfile:
+            self.lines += 1
+            self.bytes += len(line)
+            yield line
+
+
+def bench_parse(filename, sim_filter=None, sim_demux=False):
+    with open(filename, "rb") as logfile:
+        reader = CountingReader(logfile)
+        statuses = 0
+        start = time.time()
+        for _ in parse_lines(reader, sim_filter=sim_filter, sim_demux=sim_demux):
+            statuses += 1
+        elapsed = time.time() - start
+    return reader.lines, reader.bytes, statuses, elapsed
+
+
+def peak_rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def append_stamped(filename, rate, duration, style, nodes):
+    with open(filename, "ab") as output:
+        write_live(output, rate, LogGenerator(nodes, style), duration, stamp=True)
+
+
+def bench_latency(filename, rate, duration, style="gateway", nodes=1):
+    """Follow a log that another process appends to, measure the time from writing a line to its status being
+    applied to the state."""
+    open(filename, "wb").close()
+    writer = multiprocessing.Process(target=append_stamped, args=(filename, rate, duration, style, nodes))
+    writer.start()
+
+    watcher = create_watcher()
+    follower = LogFollower(filename, watcher=watcher)
+    logparser = LineParser(sim_demux=style == "simulator")
+    states = {}
+    latencies = []
+    lines = 0
+    try:
+        while True:
+            batch = follower.read_lines()
+            if not batch:
+                if not writer.is_alive():
+                    break
+                watcher.wait(0.1)
+                continue
+            lines += len(batch)
+            for line in batch:
+                status = logparser.parse(line)
+                if status is None:
+                    continue
+                state = states.get(logparser.address)
+                if state is None:
+                    state = states[logparser.address] = SubsmanagerState()
+                state.update(status)
+                if isinstance(status, ManagerStatus) and status.index == 0 and status.start > 1e15:
+                    latencies.append(time.time() - status.start / 1e6)
+    finally:
+        follower.close()
+        writer.join()
+    latencies.sort()
+    return lines, latencies
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+def record_size(record):
+    size = sys.getsizeof(record)
+    if hasattr(record, "__dict__"):
+        size += sys.getsizeof(record.__dict__)
+    return size
+
+
+def state_size(state):
+    """Memory taken by the tables and their records, not counting the field values."""
+    size = 0
+    for table in (state.managermap, state.streammap, state.middlewaremap, state.schedulermap, state.registrystatus):
+        size += sys.getsizeof(table) + sum(record_size(record) for record in table.itervalues())
+    size += sys.getsizeof(state.middlewareproviders)
+    for providers in state.middlewareproviders.itervalues():
+        size += sys.getsizeof(providers) + sum(record_size(record) for record in providers.itervalues())
+    return size
+
+
+def bench_memory(filename, sim_demux=False):
+    """Replay the log keeping a state per node and report how much memory the states take."""
+    logparser = LineParser(sim_demux=sim_demux)
+    states = {}
+    rss_before = peak_rss()
+    start = time.time()
+    for line in read_lines(filename):
+        status = logparser.parse(line)
+        if status is not None:
+            state = states.get(logparser.address)
+            if state is None:
+                state = states[logparser.address] = SubsmanagerState()
+            state.update(status)
+    elapsed = time.time() - start
+    rss_after = peak_rss()
+    return len(states), sum(state_size(state) for state in states.itervalues()), rss_after - rss_before, elapsed
+
+
+def main():
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description="Statusparser benchmark")
+    parser.add_argument("filename")
+    parser.add_argument("--sim-filter", default=None, help="Use simulation log, specify node address to filter, hex!")
+    parser.add_argument("--sim-demux", action="store_true", help="Use simulation log, keep a state for every node")
+    parser.add_argument("--memory", action="store_true", help="Measure the memory taken by the reconstructed states")
+    parser.add_argument("--repeat", default=1, type=int)
+    parser.add_argument("--generate", default=None, type=size_value, help="First write a synthetic log of this size to filename, 200M, 1G, ...")
+    parser.add_argument("--style", default="gateway", choices=STYLES, help="Logline style of --generate and --latency")
+    parser.add_argument("--nodes", default=1, type=int, help="Nodes in the --generate and --latency logs")
+    parser.add_argument("--latency", default=None, type=float, metavar="SECONDS", help="Measure the delay from appending a line to the state update, writing filename live for this long")
+    parser.add_argument("--rate", default=10000, type=float, help="Lines per second appended in the --latency run")
+    args = parser.parse_args()
+
+    if args.latency is not None:
+        lines, latencies = bench_latency(args.filename, args.rate, args.latency, args.style, args.nodes)
+        if not latencies:
+            print "%d lines, no stamped lines were seen" % lines
+            return
+        print "%d lines at %.0f lines/s, latency of %d updates: p50 %.2f ms, p99 %.2f ms, max %.2f ms" % (
+            lines, lines / args.latency, len(latencies), percentile(latencies, 50) * 1000,
+            percentile(latencies, 99) * 1000, latencies[-1] * 1000)
+        return
+
+    if args.generate is not None:
+        start = time.time()
+        with open(args.filename, "wb") as output:
+            size = write_log(output, args.generate, LogGenerator(args.nodes, args.style))
+        print "generated %.1f MB of %s log with %d nodes in %.2f s" % (size / 1e6, args.style, args.nodes,
+                                                                       time.time() - start)
+        if args.style == "simulator" and args.sim_filter is None:
+            args.sim_demux = True
+
+    if args.memory:
+        nodes, size, rss, elapsed = bench_memory(args.filename, args.sim_demux)
+        print "%d nodes in %.2f s: %d bytes of tables per node, peak RSS grew %.1f MB" % (
+            nodes, elapsed, size / nodes, rss / 1e6)
+        return
+
+    for _ in xrange(args.repeat):
+        lines, size, statuses, elapsed = bench_parse(args.filename, args.sim_filter, args.sim_demux)
+        print "%d lines, %d statuses, %.1f MB in %.2f s: %.0f lines/s, %.2f MB/s, peak RSS %.1f MB" % (
+            lines, statuses, size / 1e6, elapsed, lines / elapsed, size / 1e6 / elapsed, peak_rss() / 1e6)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python2
+"""gen_subsmanager_log.py: Write synthetic subsmanager logs for benchmarking tail_subsmanager"""
+import datetime
+import random
+import sys
+import time
+from argparse import ArgumentTypeError
+
+__author__ = "Raido Pahtma"
+__license__ = "MIT"
+
+
+STYLES = ("gateway", "iso", "simulator")
+
+MANAGERS = 8
+STREAMS = 16
+MIDDLEWARE = 4
+PROVIDERS = 3
+SCHEDULERS = 4
+REGISTRY = 4
+
+
+class LogGenerator(object):
+    """Status dumps of a number of nodes the way subsmanager logs them, in any of the logline styles the tail
+    parses: gateway (2016-04-07 13:00:57.468 : D|...), iso (2015-08-03T07:27:10.20Z 'D|...') or
+    simulator (0:28:50.537109425 DEBUG (4): ... #0004 D|...), with noise from other modules in between."""
+
+    def __init__(self, nodes=1, style="gateway", start=datetime.datetime(2016, 4, 7), seed=1, reboot=0.001):
+        if style not in STYLES:
+            raise ValueError("unknown style {}".format(style))
+        self.style = style
+        self.nodes = [0xEEA2 + i for i in xrange(nodes)] if style != "simulator" else range(1, nodes + 1)
+        self.time = start
+        self.sim_start = start
+        self.reboot = reboot  # Probability of a node rebooting instead of dumping its tables
+        self._random = random.Random(seed)
+        self._uptime = dict((node, 0) for node in self.nodes)
+
+    def line(self, node, level, module, message):
+        self.time += datetime.timedelta(microseconds=self._random.randint(100, 2000))
+        if self.style == "gateway":
+            return "%s : %s|  %s:  23|%s" % (self.time.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3], level, module, message)
+        if self.style == "iso":
+            return "%sZ '%s|%s:  23|%s'" % (self.time.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-4], level, module, message)
+        elapsed = self.time - self.sim_start
+        sim = "%d:%02d:%02d.%06d000" % (elapsed.seconds // 3600, elapsed.seconds // 60 % 60, elapsed.seconds % 60,
+                                        elapsed.microseconds)
+        return "%s DEBUG (%d): %s %s #%04X %s|%s:  23|%s" % (sim, node, self.time.strftime("%Y-%m-%d %H:%M:%S"), sim,
+                                                            node, level, module, message)
+
+    def boot(self, node):
+        self._uptime[node] = 0
+        return [self.line(node, "I", "binf", "TOS_NODE_ID %04X GUID 01A2EE0E %08X" % (node, 0x15000000 + node))]
+
+    def dump(self, node):
+        """One cycle of status dumps of a node, the counters move on a bit every time."""
+        r = self._random
+        up = self._uptime[node] = self._uptime[node] + r.randint(1, 3)
+        lines = []
+        for i in xrange(MANAGERS):
+            if i < MANAGERS // 2:
+                lines.append(self.line(node, "D", "sbslog", "s[%02d] p%d l33 (1|0) %d/3600 (1)" % (i, i % 2, up)))
+            else:
+                lines.append(self.line(node, "D", "sbslog", "s[%02d] --" % i))
+        for i in xrange(STREAMS):
+            if i < STREAMS // 2:
+                lines.append(self.line(node, "D", "sbslog", "t[%02d|%02d] m%02d:%04x(%d)(1|0) %d/%d/%d/%d %d~%d" % (
+                    i, i // 2, i % 5 + 1, 0x834e + i, i, 14, up - r.randint(0, 2), r.randint(0, 9), up // 4, 5, 6)))
+            else:
+                lines.append(self.line(node, "D", "sbslog", "t[%02d] --" % i))
+        for i in xrange(MIDDLEWARE):
+            lines.append(self.line(node, "D", "mddl", "[%02d] s1 i%04x p0 c%d 1/2/3/%d" % (
+                i, 0x834e + i, PROVIDERS, up - r.randint(0, 2))))
+            for m in xrange(PROVIDERS):
+                if r.random() < 0.1:  # Providers come and go
+                    lines.append(self.line(node, "D", "mddl", "[%02d] m%02d --" % (i, m + 2)))
+                else:
+                    lines.append(self.line(node, "D", "mddl", "[%02d] m%02d e1 s%02x 1/%d/3/4" % (
+                        i, m + 2, m + 10, up - r.randint(0, 2))))
+        for i in xrange(SCHEDULERS):
+            lines.append(self.line(node, "D", "amdl", "[%02d]<01>(%02d) s1 a%d" % (i, i + 2, r.randint(0, 1))))
+        for i in xrange(REGISTRY):
+            lines.append(self.line(node, "D", "mreg", "m%02d %04X c%d t%d 01A2EE0E %08X" % (
+                i, i + 2, r.randint(1, 3), up - r.randint(0, 5), 0x15000000 + i)))
+        lines.append(self.line(node, "I", "dclc", "output[%d]" % r.randint(0, 100)))
+        for _ in xrange(r.randint(0, 4)):
+            lines.append(self.line(node, "I", "radio", r.choice(("tx done 4", "rx from %04X" % r.choice(self.nodes)))))
+        return lines
+
+    def cycles(self):
+        """Endless lists of lines, every node boots first and then dumps its tables in turns."""
+        for node in self.nodes:
+            yield self.boot(node)
+        while True:
+            for node in self.nodes:
+                if self._random.random() < self.reboot:
+                    yield self.boot(node)
+                else:
+                    yield self.dump(node)
+
+
+def write_log(output, size, generator):
+    written = 0
+    for lines in generator.cycles():
+        data = "\n".join(lines) + "\n"
+        output.write(data)
+        written += len(data)
+        if written >= size:
+            return written
+
+
+STAMP = "s[00] p0 l33 (1|0) %d/3600 (1)"  # Manager 0 with the time of writing in microseconds as its start
+
+
+def write_live(output, rate, generator, duration=None, stamp=False):
+    """Append lines at about rate lines per second, a cycle at a time like a busy gateway would.
+    With stamp, every cycle ends with a line that tells when it was written, for measuring latency."""
+    start = time.time()
+    written = 0
+    for lines in generator.cycles():
+        if stamp:
+            lines.append(generator.line(generator.nodes[0], "D", "sbslog", STAMP % (time.time() * 1e6)))
+        output.write("\n".join(lines) + "\n")
+        output.flush()
+        written += len(lines)
+        now = time.time()
+        if duration is not None and now - start >= duration:
+            return
+        ahead = start + float(written) / rate - now
+        if ahead > 0:
+            time.sleep(ahead)
+
+
+def size_value(value):
+    """Sizes like 200M or 1.5G, the generator does not need the parsers of tail_subsmanager for this."""
+    units = {"k": 1e3, "K": 1e3, "M": 1e6, "G": 1e9}
+    try:
+        if value[-1:] in units:
+            return int(float(value[:-1]) * units[value[-1]])
+        return int(value)
+    except ValueError:
+        raise ArgumentTypeError("invalid size {}, expected a number of bytes like 4096, 200k or 16M".format(value))
+
+
+def main():
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description="Synthetic subsmanager log generator")
+    parser.add_argument("filename", help="- for stdout")
+    parser.add_argument("--size", default="100M", type=size_value, help="How much to write, 200M, 1G, ...")
+    parser.add_argument("--nodes", default=1, type=int, help="Number of nodes in the log")
+    parser.add_argument("--style", default="gateway", choices=STYLES)
+    parser.add_argument("--seed", default=1, type=int)
+    parser.add_argument("--rate", default=None, type=float, help="Keep appending this many lines per second instead of writing --size at once")
+    args = parser.parse_args()
+
+    generator = LogGenerator(args.nodes, args.style, seed=args.seed)
+    output = sys.stdout if args.filename == "-" else open(args.filename, "ab" if args.rate else "wb")
+    try:
+        if args.rate:
+            write_live(output, args.rate, generator)
+        else:
+            write_log(output, args.size, generator)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
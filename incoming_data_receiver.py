@@ -6,71 +6,713 @@ __author__ = "Raido Pahtma"
 __license__ = "MIT"
 
 import json
+import math
+import os
+import re
+import signal
+import socket
+import sys
+import threading
 import time
-from twisted.internet import reactor
+import zlib
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+from twisted.internet import reactor, error
+from twisted.internet.defer import Deferred, DeferredList
 from twisted.internet.endpoints import TCP4ServerEndpoint
 from twisted.internet.endpoints import UNIXServerEndpoint
-from twisted.internet.protocol import Protocol, Factory
-from twisted.web import server, resource
+from twisted.internet.endpoints import AdoptedStreamServerEndpoint
+from twisted.internet.protocol import Protocol, Factory, ProcessProtocol
+from twisted.internet.task import LoopingCall
+from twisted.protocols.basic import LineReceiver, Int32StringReceiver
+from twisted.web import server, resource, http
+
+MAX_MESSAGE_LENGTH = 4 * 1024 * 1024
+LISTEN_BACKLOG = 1024  # Many clients may connect at once when framed connections are kept open
+
+SUCCESS = json.dumps({"result": "SUCCESS"}).encode()
+FAIL = json.dumps({"result": "FAIL"}).encode()
+
+
+class LatencyHistogram(object):
+    """Counts of latencies in buckets that double in width, the first one is up to 10 us and the last one from 42 s."""
+    FIRST = 10e-6
+    BUCKETS = 24
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.counts[min(self.BUCKETS - 1, max(0, math.frexp(seconds / self.FIRST)[1]))] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p):
+        """Upper bound of the bucket the latency at p percent falls into."""
+        rank = self.count * p / 100.0
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return min(self.FIRST * 2 ** i, self.max)
+        return 0.0
+
+    def metrics(self):
+        ms = lambda seconds: round(seconds * 1000, 3)
+        return {"count": self.count, "mean_ms": ms(self.sum / self.count) if self.count else 0.0,
+                "p50_ms": ms(self.percentile(50)), "p99_ms": ms(self.percentile(99)), "max_ms": ms(self.max),
+                "buckets_ms": [[ms(self.FIRST * 2 ** i), count] for i, count in enumerate(self.counts) if count]}
+
+
+class EndpointStats(object):
+    """Traffic of an endpoint, the latency is from accepting a connection or receiving a message to the reply."""
+
+    def __init__(self):
+        self.connections = 0
+        self.requests = 0
+        self.bytes = 0
+        self.messages = 0
+        self.failures = 0
+        self.invalid = 0  # Failures because a message or body could not be parsed
+        self.latency = LatencyHistogram()
+
+    def replied(self, started, messages=1, failed=False, invalid=False):
+        self.requests += 1
+        self.messages += messages
+        if failed:
+            self.failures += 1
+        if invalid:
+            self.invalid += 1
+        self.latency.add(time.time() - started)
+
+    def metrics(self):
+        return {"connections": self.connections, "requests": self.requests, "bytes": self.bytes,
+                "messages": self.messages, "failures": self.failures, "invalid": self.invalid,
+                "latency": self.latency.metrics()}
+
+
+class OutputSink(object):
+    """Received messages are queued and a writer thread writes them out in batches, so a slow stdout or disk does not
+    stall the reactor. When the queue is full, messages are refused instead of waiting for room. If writing fails, the
+    writer stops, what it had queued is counted as lost and every message after that is refused."""
+
+    def __init__(self, path=None, rotate=None, backups=5, size=100000, batch=1000, validate=False):
+        """
+        @param path: File to append to, stdout if None.
+        @param rotate: Start a new file when the current one reaches this many bytes, keeping backups old ones.
+        @param size: Messages waiting to be written at most.
+        @param validate: Only accept messages that are valid JSON.
+        """
+        self.path = path
+        self.rotate = rotate
+        self.backups = backups
+        self.batch = batch
+        self.validate = validate
+        self.written = 0
+        self.invalid = 0
+        self.dropped = 0
+        self.lost = 0
+        self.error = None  # Why the writer stopped
+        self._queue = queue.Queue(size)
+        self._output = None
+        self._open()
+        self._thread = threading.Thread(target=self._run, name="output")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _open(self):
+        if self.path is None:
+            self._output = getattr(sys.stdout, "buffer", sys.stdout)
+        else:
+            self._output = open(self.path, "ab")
+
+    def _rollover(self):
+        self._output.close()
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists("%s.%d" % (self.path, i)):
+                os.rename("%s.%d" % (self.path, i), "%s.%d" % (self.path, i + 1))
+        if self.backups > 0:
+            os.rename(self.path, "%s.1" % self.path)
+        else:
+            os.remove(self.path)
+        self._open()
+
+    def valid(self, data):
+        """Whether the message may be stored, only valid JSON is if validating."""
+        if self.validate:
+            try:
+                json.loads(data)
+            except (ValueError, TypeError):
+                self.invalid += 1
+                return False
+        return True
+
+    def put(self, header, data):
+        """Queue a message for writing, returns False if it is refused. Check it with valid first."""
+        if self.error is not None:
+            self.dropped += 1
+            return False
+        try:
+            self._queue.put_nowait((header, data))
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def _run(self):
+        while True:
+            items = [self._queue.get()]
+            try:
+                while len(items) < self.batch:
+                    items.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            stop = items[-1] is None
+            if stop:
+                items.pop()
+            parts = []
+            for header, data in items:
+                if header is not None:
+                    parts.append(header)
+                parts.append(data)
+                parts.append(b"\n")
+            try:
+                self._output.write(b"".join(parts))
+                self._output.flush()
+                self.written += len(items)
+                if self.rotate is not None and self.path is not None and self._output.tell() >= self.rotate:
+                    self._rollover()
+            except (IOError, OSError, ValueError) as e:  # ValueError if a failed rollover left the file closed
+                self._failed(e, len(items))
+                return
+            if stop:
+                return
+
+    def _failed(self, e, lost):
+        self.error = e
+        sys.stderr.write("writing %s failed, refusing messages from now on: %s\n" % (self.path or "stdout", e))
+        self.lost += lost + self._drain()
+
+    def _drain(self):
+        messages = 0
+        try:
+            while True:
+                if self._queue.get_nowait() is not None:
+                    messages += 1
+        except queue.Empty:
+            return messages
+
+    def metrics(self):
+        return {"written": self.written, "queued": self._queue.qsize(), "invalid": self.invalid,
+                "dropped": self.dropped, "lost": self.lost, "error": None if self.error is None else str(self.error)}
+
+    def close(self):
+        """Write out what is queued and stop the writer."""
+        while self._thread.is_alive():  # The writer may stop on an error while the queue is full
+            try:
+                self._queue.put(None, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+        self._thread.join()
+        self.lost += self._drain()  # Put while the writer was failing
+        if self.path is not None and not self._output.closed:
+            self._output.close()
+
+
+def media_type(request):
+    """Content-type of the request without parameters like charset, None if not given."""
+    values = request.requestHeaders.getRawHeaders("content-type")
+    if values:
+        return values[0].split(";")[0].strip().lower()
+    return None
+
+
+class BulkParser(object):
+    """Splits a request body of newline delimited JSON or a JSON array into records as it arrives. The records are
+    found by scanning for the delimiters and are handed to the sink as received, they are only decoded if the sink
+    validates. Storing stops at the first record the sink refuses, so the client can send again from there. Any other
+    error means the body could not be parsed. With lines the body is newline delimited, otherwise it is an array if
+    it starts with [."""
+    REFUSED = "refused"
+    OUTSIDE = re.compile(br'[\[\]{}",]')
+    INSIDE = re.compile(br'\\.|"', re.DOTALL)
+
+    def __init__(self, sink, header, lines=False):
+        self.sink = sink
+        self.header = header
+        self.records = 0
+        self.error = None
+        self._array = False if lines else None  # None if decided by the first character of the body
+        self._buffer = b""
+        self._start = 0  # Start of the current record in the buffer
+        self._pos = 0  # Where scanning continues
+        self._depth = 0
+        self._string = False
+        self._done = False
+
+    def _record(self, end):
+        record = self._buffer[self._start:end].strip()
+        self._start = end + 1
+        if not record:
+            if self._array:
+                self.error = "empty record"
+            return  # Blank lines are fine
+        if not self.sink.valid(record):
+            self.error = "invalid record"
+        elif self.sink.put(self.header, record):
+            self.records += 1
+        else:
+            self.error = self.REFUSED
+
+    def _split_lines(self):
+        while self.error is None:
+            end = self._buffer.find(b"\n", self._pos)
+            if end < 0:
+                self._pos = len(self._buffer)
+                return
+            self._record(end)
+            self._pos = self._start
+
+    def _split_array(self):
+        buf = self._buffer
+        pos = self._pos
+        while self.error is None and not self._done:
+            if self._string:
+                m = self.INSIDE.search(buf, pos)
+                if m is None:
+                    # Escapes before pos have been matched in pairs, a backslash after it is the last byte and the
+                    # character it escapes comes later
+                    pos = len(buf) - 1 if pos < len(buf) and buf.endswith(b"\\") else len(buf)
+                    break
+                if m.group() == b'"':
+                    self._string = False
+                pos = m.end()
+                continue
+
+            m = self.OUTSIDE.search(buf, pos)
+            if m is None:
+                pos = len(buf)
+                break
+            c = m.group()
+            pos = m.end()
+            if c == b'"':
+                self._string = True
+            elif c in b"[{":
+                self._depth += 1
+                if self._depth == 1:
+                    self._start = pos
+            elif c == b",":
+                if self._depth == 1:
+                    self._record(m.start())
+            else:  # ] or }
+                self._depth -= 1
+                if self._depth == 0:
+                    if buf[self._start:m.start()].strip() or self.records:
+                        self._record(m.start())
+                    self._done = True
+        if self._done:
+            if buf[pos:].strip():
+                self.error = "data after the array"
+            pos = len(buf)
+        self._pos = pos
+
+    def feed(self, data):
+        if self.error is not None:
+            return
+        if self._array is None:
+            data = data.lstrip()
+            if not data:
+                return
+            self._array = data[:1] == b"["
+        self._buffer += data
+        if self._array:
+            self._split_array()
+        else:
+            self._split_lines()
+        # Drop what has been stored
+        self._buffer = self._buffer[self._start:]
+        self._pos -= self._start
+        self._start = 0
+        if self.error is None and len(self._buffer) > MAX_MESSAGE_LENGTH:
+            self.error = "record too long"
+
+    def finish(self):
+        if self.error is None:
+            if self._array:
+                if not self._done:
+                    self.error = "incomplete array"
+            elif self._array is not None:
+                self._pos = len(self._buffer)
+                self._record(len(self._buffer))
+        return self.error is None
+
+
+def gzip_decompressor():
+    return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+
+def gzip_ended(decompressor):
+    """Whether the gzip member has been decompressed to its end, the trailer included."""
+    if hasattr(decompressor, "eof"):
+        return decompressor.eof
+    # zlib of python 2 does not tell, after the end a byte is left unused
+    probe = decompressor.copy()
+    try:
+        probe.decompress(b"\0")
+    except zlib.error:
+        return False
+    return probe.unused_data == b"\0"
+
+
+class StreamingChannel(http.HTTPChannel):
+    """Remembers the path of every request line, the requests need it before their body arrives."""
+
+    def lineReceived(self, line):
+        requests = len(self.requests)
+        http.HTTPChannel.lineReceived(self, line)
+        if len(self.requests) > requests:  # This was a request line
+            parts = line.split()
+            self.requests[-1].target = parts[1] if len(parts) == 3 else b""
+
+
+class StreamingRequest(server.Request):
+    """Request that hands the body of a bulk POST to a BulkParser chunk by chunk instead of collecting it, and
+    decompresses gzip bodies as they arrive. A decompressed body other than bulk may not be longer than
+    MAX_MESSAGE_LENGTH, a truncated one is malformed."""
+    BULK_TYPES = ("application/json", "application/x-ndjson", "application/ndjson", "application/jsonl")
+    LINE_TYPES = BULK_TYPES[1:]  # Newline delimited even if a record is an array
+    INFLATE_CHUNK = 64 * 1024
+
+    bulk = None
+    malformed = False
+    target = b""
+    _decompressor = None
+    _inflated = 0
+
+    def __init__(self, *args, **kwargs):
+        server.Request.__init__(self, *args, **kwargs)
+        self.started = time.time()
+
+    def gotLength(self, length):
+        server.Request.gotLength(self, length)
+        if self.requestHeaders.getRawHeaders("content-encoding", [""])[0].lower() == "gzip":
+            self._decompressor = gzip_decompressor()
+        receiver = self.channel.site.resource
+        if self.target.split(b"?")[0] == WebserviceDataReceiver.BULK_PATH and media_type(self) in self.BULK_TYPES:
+            self.bulk = BulkParser(receiver.sink, receiver.header(), lines=media_type(self) in self.LINE_TYPES)
+
+    def handleContentChunk(self, data):
+        self.channel.site.resource.stats.bytes += len(data)
+        if self.malformed:
+            return
+        if self._decompressor is None:
+            self._content(data)
+            return
+        try:
+            while not self.malformed:
+                if self._decompressor.unused_data:  # Another gzip member follows
+                    data = self._decompressor.unused_data + data
+                    self._decompressor = gzip_decompressor()
+                data = self._decompressor.decompress(data, self.INFLATE_CHUNK)
+                self._content(data)
+                if len(data) < self.INFLATE_CHUNK and not self._decompressor.unused_data:
+                    break
+                data = self._decompressor.unconsumed_tail
+        except zlib.error:
+            self.malformed = True
+
+    def _content(self, data):
+        if self.bulk is not None:
+            self.bulk.feed(data)
+            return
+        self._inflated += len(data)
+        if self._inflated > MAX_MESSAGE_LENGTH:
+            self.malformed = True
+        else:
+            self.content.write(data)
+
+    def requestReceived(self, command, path, version):
+        if self._decompressor is not None and not self.malformed:
+            if not gzip_ended(self._decompressor):
+                self.malformed = True
+            else:
+                self._content(self._decompressor.flush())
+        server.Request.requestReceived(self, command, path, version)
+
+
+class CountingSite(server.Site):
+    protocol = StreamingChannel
+
+    #noinspection PyPep8Naming
+    def buildProtocol(self, addr):
+        self.resource.stats.connections += 1
+        return server.Site.buildProtocol(self, addr)
 
 
 class WebserviceDataReceiver(resource.Resource):
     isLeaf = True
+    BULK_PATH = b"/bulk"  # NDJSON or a JSON array of many messages
 
-    def __init__(self, twisted_reactor, port):
+    def __init__(self, twisted_reactor, port, sink, endpoint=None):
         """
         @param twisted_reactor: Twisted reactor instance.
         @param port: Webservice port.
          @type port: int
+        @param sink: OutputSink for the received messages.
+        @param endpoint: Listen on this endpoint instead of the port.
         """
         resource.Resource.__init__(self)
         self.reactor = twisted_reactor
+        self.sink = sink
         self.name = None
+        self.stats = EndpointStats()
+        self.metrics = None  # Returns a dict for GET /metrics
 
-        self.reactor.listenTCP(port, server.Site(self))
+        if endpoint is None:
+            endpoint = TCP4ServerEndpoint(self.reactor, port, backlog=LISTEN_BACKLOG)
+        endpoint.listen(CountingSite(self, requestFactory=StreamingRequest))
 
     #noinspection PyPep8Naming,PyUnusedLocal
     def render_GET(self, request):
+        if request.path == b"/metrics" and self.metrics is not None:
+            request.setHeader("content-type", "application/json")
+            return json.dumps(self.metrics(), sort_keys=True).encode()
         return '<html><body>...</body></html>'
 
+    def header(self):
+        if self.name is not None:
+            return ("%s %s:\n" % (self.name, time.strftime("%Y-%m-%d %H:%M:%S UTC", time.gmtime()))).encode()
+        return None
+
     #noinspection PyPep8Naming
     def render_POST(self, request):
         request.setHeader("content-type", "application/json")
-        if request.requestHeaders.hasHeader("content-type"):
-            if "application/json" in request.requestHeaders.getRawHeaders("content-type"):
-                try:
-                    rj = json.loads(request.content.getvalue())
-                    if self.name is not None:
-                        print("%s %s:" % (self.name, time.strftime("%Y-%m-%d %H:%M:%S UTC", time.gmtime())))
-                    print(json.dumps(rj))
-                    return json.dumps({"result": "SUCCESS"})
-                except (ValueError, TypeError):
-                    pass
+        if request.malformed and request.bulk is not None:  # The records before the damage are stored already
+            self.stats.replied(request.started, request.bulk.records, True, True)
+            return json.dumps({"result": "FAIL", "records": request.bulk.records, "error": "bad gzip body"}).encode()
+        if request.malformed:
+            self.stats.replied(request.started, 0, True, True)
+            return FAIL
+        if request.bulk is not None:
+            ok = request.bulk.finish()
+            invalid = request.bulk.error not in (None, BulkParser.REFUSED)
+            self.stats.replied(request.started, request.bulk.records, not ok, invalid)
+            if ok:
+                return json.dumps({"result": "SUCCESS", "records": request.bulk.records}).encode()
+            return json.dumps({"result": "FAIL", "records": request.bulk.records, "error": request.bulk.error}).encode()
 
-        return json.dumps({"result": "FAIL"})
+        if request.path != self.BULK_PATH and media_type(request) == "application/json":
+            data = request.content.getvalue()
+            if not self.sink.valid(data):
+                self.stats.replied(request.started, 0, True, True)
+                return FAIL
+            if self.sink.put(self.header(), data):
+                self.stats.replied(request.started)
+                return SUCCESS
+
+        self.stats.replied(request.started, 0, True)
+        return FAIL
 
 
 class SocketDataReceiver(Protocol):
     def __init__(self):
-        pass
+        self.started = time.time()
+
+    #noinspection PyPep8Naming
+    def dataReceived(self, data):
+        self.factory.stats.bytes += len(data)
+        self.transport.write(self.factory.message_received(data, self.started))
+        self.transport.loseConnection()
+
+
+class LineDataReceiver(LineReceiver):
+    """Newline delimited JSON messages, the connection stays open and every message gets a reply line."""
+    delimiter = b"\n"
+    MAX_LENGTH = MAX_MESSAGE_LENGTH
 
     #noinspection PyPep8Naming
     def dataReceived(self, data):
-        if self.factory.name is not None:
-            print("%s:" % (self.factory.name))
-        print(data)
-        self.transport.write(json.dumps({"result": "SUCCESS"}))
+        self.received = time.time()
+        self.factory.stats.bytes += len(data)
+        LineReceiver.dataReceived(self, data)
+
+    #noinspection PyPep8Naming
+    def lineReceived(self, line):
+        self.sendLine(self.factory.message_received(line.rstrip(b"\r"), self.received))
+
+    #noinspection PyPep8Naming
+    def lineLengthExceeded(self, line):
+        self.factory.stats.invalid += 1
+        self.transport.loseConnection()
+
+
+class LengthPrefixedDataReceiver(Int32StringReceiver):
+    """JSON messages with a 4 byte big endian length prefix, the connection stays open and every message gets a reply
+    in the same framing."""
+    MAX_LENGTH = MAX_MESSAGE_LENGTH
+
+    #noinspection PyPep8Naming
+    def dataReceived(self, data):
+        self.received = time.time()
+        self.factory.stats.bytes += len(data)
+        Int32StringReceiver.dataReceived(self, data)
+
+    #noinspection PyPep8Naming
+    def stringReceived(self, data):
+        self.sendString(self.factory.message_received(data, self.received))
+
+    #noinspection PyPep8Naming
+    def lengthLimitExceeded(self, length):
+        self.factory.stats.invalid += 1
         self.transport.loseConnection()
 
 
 class SocketDataReceiverFactory(Factory):
-    protocol = SocketDataReceiver
+    # Without framing every connection carries one message, whatever arrives in the first read
+    protocols = {None: SocketDataReceiver, "line": LineDataReceiver, "length": LengthPrefixedDataReceiver}
 
-    def __init__(self, endpoint):
+    def __init__(self, endpoint, sink, framing=None):
         self.name = None
+        self.sink = sink
+        self.stats = EndpointStats()
+        self.protocol = self.protocols[framing]
         self._endpoint = endpoint
         self._endpoint.listen(self)
 
+    #noinspection PyPep8Naming
+    def buildProtocol(self, addr):
+        self.stats.connections += 1
+        return Factory.buildProtocol(self, addr)
+
+    def message_received(self, data, started):
+        """Handle a message that started arriving at started, returns the reply."""
+        header = ("%s:\n" % self.name).encode() if self.name is not None else None
+        if not self.sink.valid(data):
+            self.stats.replied(started, 0, True, True)
+            return FAIL
+        if self.sink.put(header, data):
+            self.stats.replied(started)
+            return SUCCESS
+        self.stats.replied(started, 0, True)
+        return FAIL
+
+
+class SharedUNIXServerEndpoint(AdoptedStreamServerEndpoint):
+    """A UNIX socket inherited from run_workers, which removes the socket file once all the workers have ended.
+    A closed port would remove it, so the port only stops accepting at shutdown and is left open."""
+
+    def __init__(self, twisted_reactor, fileno):
+        AdoptedStreamServerEndpoint.__init__(self, twisted_reactor, fileno, socket.AF_UNIX)
+
+    def listen(self, factory):
+        return AdoptedStreamServerEndpoint.listen(self, factory).addCallback(self._listening)
+
+    def _listening(self, port):
+        self.reactor.addSystemEventTrigger("before", "shutdown", port.stopReading)
+        return port
+
+
+def stop_reactor(*args):
+    """Stop the reactor unless it is stopping already."""
+    try:
+        reactor.stop()
+    except error.ReactorNotRunning:
+        pass
+
+
+def handle_stop_signals():
+    """Replace the SIGINT and SIGTERM handlers of the reactor, which fail when a signal arrives again while stopping.
+    Call when the reactor is running, it installs its handlers on start."""
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *args: reactor.callFromThread(stop_reactor))
+
+
+def ignore_stop_signals():
+    """Once the reactor has stopped the process is ending anyway, a late SIGTERM from run_workers would only cut that
+    short."""
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, signal.SIG_IGN)
+
+
+class Worker(ProcessProtocol):
+
+    def __init__(self, index):
+        self.index = index
+        self.ended = Deferred()
+
+    #noinspection PyPep8Naming
+    def processEnded(self, reason):
+        sys.stderr.write("worker %d ended: %s\n" % (self.index, reason.getErrorMessage()))
+        self.ended.callback(None)
+
+    def stop(self):
+        try:
+            self.transport.signalProcess("TERM")
+        except error.ProcessExitedAlready:
+            pass
+        return self.ended
+
+
+def listening_socket(family, address):
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    if family == socket.AF_INET:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(address)
+    sock.listen(LISTEN_BACKLOG)
+    sock.setblocking(False)
+    return sock
+
+
+def worker_output(path, index):
+    """Every worker writes a file of its own, out.log becomes out.0.log, out.1.log, ..."""
+    root, ext = os.path.splitext(path)
+    return "%s.%d%s" % (root, index, ext)
+
+
+def run_workers(args, argv):
+    """Listen on the sockets and start the workers that accept the connections, until they have all ended.
+    The workers are new processes running this script, they inherit the listening sockets."""
+    sockets = []
+    if args.webservice is not None:
+        sockets.append(("--webservice-fd", listening_socket(socket.AF_INET, ("", args.webservice))))
+    if args.socket is not None:
+        sockets.append(("--socket-fd", listening_socket(socket.AF_UNIX, args.socket)))
+    if args.tcp is not None:
+        sockets.append(("--tcp-fd", listening_socket(socket.AF_INET, ("", args.tcp))))
+
+    fds = {0: 0, 1: 1, 2: 2}
+    for option, sock in sockets:
+        fds[sock.fileno()] = sock.fileno()
+        argv = argv + [option, str(sock.fileno())]
+
+    script = os.path.abspath(__file__)
+    workers = []
+    for i in range(args.workers):
+        worker = Worker(i)
+        reactor.spawnProcess(worker, sys.executable, [sys.executable, script] + argv + ["--worker", str(i)],
+                             env=os.environ, childFDs=fds)
+        workers.append(worker)
+
+    DeferredList([worker.ended for worker in workers]).addCallback(stop_reactor)
+    reactor.callWhenRunning(handle_stop_signals)
+    reactor.addSystemEventTrigger("before", "shutdown", lambda: DeferredList([w.stop() for w in workers]))
+    reactor.run()
+    ignore_stop_signals()
+
+    for _, sock in sockets:
+        sock.close()
+    if args.socket is not None and os.path.exists(args.socket):
+        os.unlink(args.socket)
+
 
 def main():
     import argparse
@@ -80,27 +722,82 @@ def main():
     parser.add_argument("--webservice", default=None, type=int, help="9998")
     parser.add_argument("--socket", default=None, type=str, help="/tmp/subsserver_data_receiver.sock")
     parser.add_argument("--tcp", default=None, type=int, help="9997")
+    parser.add_argument("--framing", default=None, choices=("line", "length"),
+                        help="Keep socket connections open for many messages, newline delimited or with a 4 byte big endian length prefix, replies are framed the same way. Without it every connection carries one message")
+    parser.add_argument("--output", default=None, help="Append the messages to this file instead of stdout")
+    parser.add_argument("--rotate", default=None, type=int, metavar="MB", help="Start a new --output file when it grows this large")
+    parser.add_argument("--backups", default=5, type=int, help="Rotated --output files to keep")
+    parser.add_argument("--queue", default=100000, type=int, help="Messages waiting to be written at most, more are refused")
+    parser.add_argument("--batch", default=1000, type=int, help="Messages written at once at most")
+    parser.add_argument("--validate", action="store_true", help="Refuse messages that are not valid JSON, otherwise they are stored as received")
+    parser.add_argument("--stats", default=None, type=float, metavar="SECONDS", help="Write the counters and latencies of the endpoints to stderr this often and at exit, they are always on GET /metrics of the webservice. With --workers every worker counts its own and /metrics shows the worker that answered")
+    parser.add_argument("--workers", default=1, type=int, help="Processes accepting connections on the same ports, each writes an --output file of its own")
+    # Set for the worker processes by run_workers
+    parser.add_argument("--worker", default=None, type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--webservice-fd", default=None, type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--socket-fd", default=None, type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--tcp-fd", default=None, type=int, help=argparse.SUPPRESS)
 
     args = parser.parse_args()
 
-    wdr = sdr = tdr = None
+    if args.webservice is None and args.socket is None and args.tcp is None:
+        parser.print_help()
+        exit(1)
+
+    if args.worker is None and args.workers > 1:
+        if args.output is None:
+            parser.error("--workers needs --output, the workers would mix their output on stdout")
+        run_workers(args, sys.argv[1:])
+        return
+
+    output = args.output
+    endpoints = {}
+    if args.worker is not None:
+        output = worker_output(output, args.worker)
+        if args.webservice_fd is not None:
+            endpoints["webservice"] = AdoptedStreamServerEndpoint(reactor, args.webservice_fd, socket.AF_INET)
+        if args.socket_fd is not None:
+            endpoints["socket"] = SharedUNIXServerEndpoint(reactor, args.socket_fd)
+        if args.tcp_fd is not None:
+            endpoints["tcp"] = AdoptedStreamServerEndpoint(reactor, args.tcp_fd, socket.AF_INET)
+
+    sink = OutputSink(output, args.rotate * 1024 * 1024 if args.rotate else None, args.backups,
+                      args.queue, args.batch, args.validate)
+
+    receivers = {}
     if args.webservice is not None:
-        wdr = WebserviceDataReceiver(reactor, args.webservice)
+        wdr = receivers["webservice"] = WebserviceDataReceiver(reactor, args.webservice, sink, endpoints.get("webservice"))
         wdr.name = "WEBSERVICE"
 
     if args.socket is not None:
-        sdr = SocketDataReceiverFactory(UNIXServerEndpoint(reactor, args.socket))
+        endpoint = endpoints.get("socket") or UNIXServerEndpoint(reactor, args.socket, backlog=LISTEN_BACKLOG)
+        sdr = receivers["socket"] = SocketDataReceiverFactory(endpoint, sink, args.framing)
         sdr.name = "SOCKET"
 
     if args.tcp is not None:
-        tdr = SocketDataReceiverFactory(TCP4ServerEndpoint(reactor, args.tcp))
+        endpoint = endpoints.get("tcp") or TCP4ServerEndpoint(reactor, args.tcp, backlog=LISTEN_BACKLOG)
+        tdr = receivers["tcp"] = SocketDataReceiverFactory(endpoint, sink, args.framing)
         tdr.name = "TCP"
 
-    if wdr is None and sdr is None and tdr is None:
-        parser.print_help()
-        exit(1)
+    started = time.time()
+
+    def metrics():
+        return {"uptime": round(time.time() - started, 3), "worker": args.worker, "output": sink.metrics(),
+                "endpoints": dict((name, receiver.stats.metrics()) for name, receiver in receivers.items())}
+
+    def dump_metrics():
+        sys.stderr.write(json.dumps(metrics(), sort_keys=True) + "\n")
+
+    reactor.addSystemEventTrigger("after", "shutdown", sink.close)
+    if args.webservice is not None:
+        wdr.metrics = metrics
+    if args.stats:
+        LoopingCall(dump_metrics).start(args.stats, now=False)
+        reactor.addSystemEventTrigger("after", "shutdown", dump_metrics)
 
+    reactor.callWhenRunning(handle_stop_signals)
     reactor.run()
+    ignore_stop_signals()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+
+"""Load generator for the endpoints of incoming_data_receiver"""
+
+__author__ = "Raido Pahtma"
+__license__ = "MIT"
+
+import collections
+import json
+import time
+from io import BytesIO
+from twisted.internet import reactor
+from twisted.internet.protocol import Protocol, ClientFactory
+from twisted.internet.task import LoopingCall
+from twisted.protocols.basic import LineReceiver, Int32StringReceiver
+from twisted.web.client import Agent, HTTPConnectionPool, FileBodyProducer, readBody
+from twisted.web.http_headers import Headers
+
+from incoming_data_receiver import MAX_MESSAGE_LENGTH
+
+TICK = 0.005  # How often messages are scheduled with --rate
+
+
+class LoadClient(object):
+    """Sends the messages given to it over one connection, keeping up to window of them waiting for a reply.
+    Comes before the framing protocol in the bases."""
+
+    #noinspection PyPep8Naming
+    def connectionMade(self):
+        self.pending = collections.deque()  # When the messages waiting to be sent were due, None for right away
+        self.waiting = collections.deque()  # When the messages waiting for a reply were due
+        self.factory.connected(self)
+
+    def send(self, due=None):
+        self.pending.append(due)
+        self._send_more()
+
+    def _send_more(self):
+        while self.pending and len(self.waiting) < self.factory.window:
+            due = self.pending.popleft()
+            self.waiting.append(due if due is not None else time.time())
+            self.send_message(self.factory.message())
+
+    def reply_received(self, data):
+        self.factory.reply(data, self.waiting.popleft())
+        self._send_more()
+
+    #noinspection PyPep8Naming
+    def connectionLost(self, reason=None):
+        self.factory.disconnected(self, len(self.pending) + len(self.waiting))
+
+
+class LineLoadClient(LoadClient, LineReceiver):
+    delimiter = b"\n"
+    MAX_LENGTH = MAX_MESSAGE_LENGTH
+
+    def send_message(self, data):
+        self.sendLine(data)
+
+    #noinspection PyPep8Naming
+    def lineReceived(self, line):
+        self.reply_received(line)
+
+
+class LengthPrefixedLoadClient(LoadClient, Int32StringReceiver):
+    MAX_LENGTH = MAX_MESSAGE_LENGTH
+
+    def send_message(self, data):
+        self.sendString(data)
+
+    #noinspection PyPep8Naming
+    def stringReceived(self, data):
+        self.reply_received(data)
+
+
+class WebserviceLoadClient(LoadClient):
+    """Posts the messages to the webservice one at a time, over a persistent connection from the pool of the agent."""
+    HEADERS = Headers({"content-type": ["application/json"]})
+
+    def __init__(self, factory, agent, url):
+        self.factory = factory
+        self.agent = agent
+        self.url = url
+        self.connectionMade()
+
+    def send_message(self, data):
+        d = self.agent.request(b"POST", self.url, self.HEADERS, FileBodyProducer(BytesIO(data)))
+        d.addCallback(readBody)
+        d.addCallbacks(self.reply_received, self.request_failed)
+
+    def request_failed(self, failure):
+        self.waiting.popleft()
+        self.factory.lost(1)
+        self._send_more()
+
+
+class OneShotLoadClient(Protocol):
+    """Without framing every message needs a connection of its own, the receiver closes it after replying."""
+
+    #noinspection PyPep8Naming
+    def connectionMade(self):
+        self._reply = []
+        self._due = self.factory.due(self.transport.connector)
+        self.transport.write(self.factory.message())
+
+    #noinspection PyPep8Naming
+    def dataReceived(self, data):
+        self._reply.append(data)
+
+    #noinspection PyPep8Naming
+    def connectionLost(self, reason=None):
+        self.factory.reply(b"".join(self._reply), self._due)
+
+
+class LoadFactory(ClientFactory):
+    """Without a rate, every connection sends its share of the messages as fast as the replies come. With a rate, the
+    messages are due at even intervals and go to the connections in turns, the latency is counted from when a
+    message was due, so a receiver that falls behind is seen in it."""
+    protocols = {None: OneShotLoadClient, "line": LineLoadClient, "length": LengthPrefixedLoadClient}
+
+    def __init__(self, connect, framing, connections, messages, window=1, size=100, rate=None):
+        self.protocol = self.protocols.get(framing)
+        self.oneshot = framing is None
+        self.connect = connect  # Opens another connection with this factory, returns the connector if there is one
+        self.window = window
+        self.rate = rate
+        self.total = messages
+        # Without a rate, the messages of every framed connection, the remainder goes one each to the first ones
+        self._shares = collections.deque(messages // connections + (1 if i < messages % connections else 0)
+                                         for i in range(connections))
+        self.padding = "x" * size
+        self.results = {}
+        self.latencies = []
+        self.received = 0
+        self.opened = 0
+        self.scheduled = 0
+        self.clients = []
+        self.start = self.end = None
+        self._connections = connections
+        self._resolved = 0  # Connections that have been made or have failed
+        self._sequence = 0
+        self._ticker = LoopingCall(self.tick)
+
+    def _open(self, due=None):
+        self.opened += 1
+        connector = self.connect(self)
+        if self.oneshot:  # Kept with the connection, they may be made or fail in any order
+            connector.due = due
+
+    @staticmethod
+    def due(connector):
+        """When the message of a one shot connection was due, now if it was to be sent right away."""
+        return connector.due if connector.due is not None else time.time()
+
+    def run(self):
+        self.start = time.time()
+        if not self.oneshot:
+            for _ in range(self._connections):
+                self._open()
+        elif self.rate is None:  # Every connection opens the next one when it is done
+            for _ in range(min(self._connections, self.total)):
+                self._open()
+        else:
+            self._ticker.start(TICK)
+
+    def connected(self, client):
+        self.clients.append(client)
+        if self.rate is None:
+            for _ in range(self._shares.popleft()):
+                client.send()
+        self._connection_resolved()
+
+    def _connection_resolved(self):
+        self._resolved += 1
+        if self.rate is not None and self._resolved == self._connections:  # Everyone is connected, go
+            if self.clients:
+                self.start = time.time()
+                self._ticker.start(TICK)
+            else:
+                self._count("NO_CONNECTION", self.total)
+
+    def tick(self):
+        due = min(self.total, int((time.time() - self.start) * self.rate) + 1)
+        while self.scheduled < due:
+            at = self.start + self.scheduled / self.rate
+            self.scheduled += 1
+            if self.oneshot:
+                self._open(at)
+            else:
+                self.clients[self.scheduled % len(self.clients)].send(at)
+        if self.scheduled == self.total:
+            self._ticker.stop()
+
+    def disconnected(self, client, unanswered):
+        if self.end is not None:
+            return
+        self.clients.remove(client)
+        if self.rate is not None and not self.clients:  # Nobody left to send the rest
+            unanswered += self.total - self.scheduled
+            self.scheduled = self.total
+            if self._ticker.running:
+                self._ticker.stop()
+        if unanswered:
+            self.lost(unanswered)
+
+    def message(self):
+        self._sequence += 1
+        return json.dumps({"sequence": self._sequence, "sent": time.time(), "data": self.padding}).encode()
+
+    def reply(self, data, due):
+        self.latencies.append(time.time() - due)
+        try:
+            result = json.loads(data)["result"]
+        except (ValueError, TypeError, KeyError):
+            result = "INVALID"
+        self._count(result, 1)
+
+    def lost(self, messages):
+        self._count("LOST", messages)
+
+    def _count(self, result, messages):
+        if self.end is not None:
+            return
+        self.results[result] = self.results.get(result, 0) + messages
+        self.received += messages
+        if self.received >= self.total:
+            self.end = time.time()
+            reactor.stop()
+        elif self.oneshot and self.rate is None and self.opened < self.total:
+            self._open()
+
+    #noinspection PyPep8Naming
+    def clientConnectionFailed(self, connector, reason):
+        if self.oneshot:
+            self._count("NO_CONNECTION", 1)
+        elif self.rate is None:
+            self._count("NO_CONNECTION", self._shares.popleft())
+            self._connection_resolved()
+        else:
+            self._connection_resolved()
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Load generator for incoming_data_receiver", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--webservice", default=None, type=int, help="9998")
+    parser.add_argument("--socket", default=None, type=str, help="/tmp/subsserver_data_receiver.sock")
+    parser.add_argument("--tcp", default=None, type=int, help="9997")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--framing", default=None, choices=("line", "length"), help="Same as given to the receiver")
+    parser.add_argument("--connections", default=100, type=int)
+    parser.add_argument("--messages", default=100000, type=int, help="In total, spread over the connections")
+    parser.add_argument("--window", default=10, type=int, help="Messages sent ahead of the replies on a framed connection")
+    parser.add_argument("--size", default=100, type=int, help="Bytes of padding in every message")
+    parser.add_argument("--rate", default=None, type=float, help="Send this many messages per second instead of as fast as the replies come")
+
+    args = parser.parse_args()
+    if args.messages < 1 or args.connections < 1:
+        parser.error("--messages and --connections must be at least 1")
+
+    framing = args.framing
+    window = args.window
+    if args.webservice is not None:
+        pool = HTTPConnectionPool(reactor, persistent=True)
+        pool.maxPersistentPerHost = args.connections
+        agent = Agent(reactor, pool=pool)
+        url = ("http://%s:%d/" % (args.host, args.webservice)).encode()
+        framing = "http"  # Every client keeps one request going on a connection of its own
+        window = 1
+
+        def connect(factory):
+            WebserviceLoadClient(factory, agent, url)
+    elif args.socket is not None:
+        def connect(factory):
+            return reactor.connectUNIX(args.socket, factory)
+    elif args.tcp is not None:
+        def connect(factory):
+            return reactor.connectTCP(args.host, args.tcp, factory)
+    else:
+        parser.print_help()
+        exit(1)
+
+    factory = LoadFactory(connect, framing, args.connections, args.messages, window, args.size, args.rate)
+    reactor.callWhenRunning(factory.run)
+    reactor.run()
+
+    if factory.end is not None:
+        elapsed = factory.end - factory.start
+        print("%d messages over %d connections in %.2f s: %.0f messages/s%s, %s" % (
+            factory.received, args.connections, elapsed, factory.received / elapsed,
+            " (rate %.0f)" % args.rate if args.rate else "",
+            ", ".join("%s %d" % item for item in sorted(factory.results.items()))))
+        latencies = sorted(factory.latencies)
+        if latencies:
+            print("latency of %d replies: p50 %.2f ms, p99 %.2f ms, max %.2f ms" % (
+                len(latencies), percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000,
+                latencies[-1] * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python2
+"""query_subsmanager_store.py: Query the stream, provider and registry history stored by tail_subsmanager --store"""
+import calendar
+import os
+import time
+
+import numpy
+
+from tail_subsmanager import HistoryStore, log_time
+
+__author__ = "Raido Pahtma"
+__license__ = "MIT"
+
+
+def epoch(value):
+    value = value.replace("T", " ").rstrip("Z")
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return calendar.timegm(time.strptime(value.split(".")[0], fmt))
+        except ValueError:
+            pass
+    raise ValueError(value)
+
+
+def format_time(t):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(t))
+
+
+def load(directory, table, since=None, until=None):
+    """Columns of a table as arrays, memory mapped, limited to the rows between since and until."""
+    path = os.path.join(directory, table)
+    columns = {}
+    for name in sorted(os.listdir(path)):  # A wider copy of a column comes later and wins
+        column, kind = name.rsplit(".", 1)
+        dtype = numpy.dtype(kind)
+        if os.path.getsize(os.path.join(path, name)) >= dtype.itemsize:
+            columns[column] = numpy.memmap(os.path.join(path, name), dtype=dtype, mode="r")
+        else:
+            columns[column] = numpy.zeros(0, dtype=dtype)
+    rows = min(len(values) for values in columns.itervalues())
+    mask = numpy.ones(rows, dtype=bool)
+    if since is not None:
+        mask &= columns["time"][:rows] >= since
+    if until is not None:
+        mask &= columns["time"][:rows] < until
+    return dict((column, values[:rows][mask]) for column, values in columns.iteritems())
+
+
+def grouped(columns, keys):
+    """Order that sorts the rows by keys and then time, and for every row in that order whether it starts a group."""
+    order = numpy.lexsort([columns["time"]] + [columns[key] for key in reversed(keys)])
+    same = numpy.ones(len(order), dtype=bool)
+    same[:1] = False
+    for key in keys:
+        values = columns[key][order]
+        same[1:] &= values[1:] == values[:-1]
+    return order, ~same
+
+
+def gaps(columns, minimum):
+    """Delivery gaps: the contact of a row did not advance for more than minimum seconds. contact is the uptime of the
+    node at the last contact, so a jump in it is the length of the silence, a drop is a reboot and is ignored."""
+    order, start = grouped(columns, ("node", "index", "mote"))
+    contact = columns["contact"][order].astype(numpy.int64)
+    jump = numpy.zeros(len(order), dtype=numpy.int64)
+    jump[1:] = contact[1:] - contact[:-1]
+    found = ~start & (contact >= 0) & (jump > minimum)
+    found[1:] &= contact[:-1] >= 0
+    rows = order[found]
+    return rows, jump[found]
+
+
+def churn(columns):
+    """How many times every mote appeared as a provider and went away again, per node."""
+    order, start = grouped(columns, ("node", "index", "mote"))
+    live = columns["live"][order] == 1
+    previous = numpy.zeros(len(order), dtype=bool)
+    previous[1:] = live[:-1]
+    appeared = live & (start | ~previous)
+    left = ~live & ~start & previous
+
+    node = columns["node"][order].astype(numpy.int64)
+    mote = columns["mote"][order].astype(numpy.int64)
+    key = (node << 32) | (mote & 0xFFFFFFFF)
+    motes, inverse = numpy.unique(key, return_inverse=True)
+    return (motes >> 32, motes & 0xFFFFFFFF, numpy.bincount(inverse, weights=appeared, minlength=len(motes)),
+            numpy.bincount(inverse, weights=left, minlength=len(motes)))
+
+
+def main():
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description="Subsmanager history queries")
+    parser.add_argument("directory", help="The --store directory of tail_subsmanager")
+    parser.add_argument("query", choices=("gaps", "churn", "summary"))
+    parser.add_argument("--table", default="streams", choices=("streams", "providers"), help="Table for gaps")
+    parser.add_argument("--min", default=600, type=int, help="Shortest gap to report, seconds")
+    parser.add_argument("--mote", default=None, type=int, help="Only this mote")
+    parser.add_argument("--node", default=None, help="Only this node, hex")
+    parser.add_argument("--since", default=None, type=log_time)
+    parser.add_argument("--until", default=None, type=log_time)
+    parser.add_argument("--top", default=50, type=int, help="How many rows to print, 0 for all")
+    args = parser.parse_args()
+
+    since = epoch(args.since) if args.since is not None else None
+    until = epoch(args.until) if args.until is not None else None
+    table = "providers" if args.query == "churn" else args.table
+
+    start = time.time()
+    if args.query == "summary":
+        for name in [name for _, name, _ in HistoryStore.TABLES]:
+            columns = load(args.directory, name, since, until)
+            times = columns["time"]
+            if len(times):
+                print "%-10s %10d rows, %d nodes, %s - %s" % (name, len(times), len(numpy.unique(columns["node"])),
+                                                              format_time(numpy.nanmin(times)),
+                                                              format_time(numpy.nanmax(times)))
+            else:
+                print "%-10s %10d rows" % (name, 0)
+        return
+
+    columns = load(args.directory, table, since, until)
+    mask = numpy.ones(len(columns["time"]), dtype=bool)
+    if args.mote is not None:
+        mask &= columns["mote"] == args.mote
+    if args.node is not None:
+        mask &= columns["node"] == int(args.node, 16)
+    columns = dict((column, values[mask]) for column, values in columns.iteritems())
+
+    if args.query == "gaps":
+        rows, lengths = gaps(columns, args.min)
+        longest = numpy.argsort(-lengths, kind="mergesort")
+        if args.top:
+            longest = longest[:args.top]
+        print "%d gaps over %d s in %d rows (%.2f s)" % (len(rows), args.min, len(columns["time"]), time.time() - start)
+        print "node|  row|mote|___gap_s__|_contact_again_____"
+        for i in longest:
+            row = rows[i]
+            print "%04X|%5d|%4d|%10d|%s" % (columns["node"][row], columns["index"][row], columns["mote"][row],
+                                           lengths[i], format_time(columns["time"][row]))
+    else:
+        nodes, motes, appeared, left = churn(columns)
+        busiest = numpy.argsort(-appeared, kind="mergesort")
+        if args.top:
+            busiest = busiest[:args.top]
+        print "%d motes in %d rows (%.2f s)" % (len(motes), len(columns["time"]), time.time() - start)
+        print "node|mote|appeared|___left_"
+        for i in busiest:
+            print "%04X|%4d|%8d|%8d" % (nodes[i], motes[i], appeared[i], left[i])
+
+
+if __name__ == "__main__":
+    main()
@@ -1,38 +1,220 @@
 #!/usr/bin/env python2
 """tail_subsmanager.py: Tool for monitoring subscription manager state from logfiles"""
+import array
 import calendar
 import sys
 import os
 import time
 import re
 import datetime
-from stat import ST_SIZE
+import errno
+import io
+import select
+import ctypes
+import ctypes.util
+import fcntl
+import struct
+import termios
+import tty
+import glob
+import cPickle
+import cProfile
+import pstats
+import json
+import bisect
+import operator
+import gzip
+import bz2
+import subprocess
+import socket
+from argparse import ArgumentTypeError
+from distutils.spawn import find_executable
+
+from gen_subsmanager_log import size_value
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:  # xz compressed logs are decompressed with the xz tool then
+        lzma = None
 
 __author__ = "Raido Pahtma"
 __license__ = "MIT"
 
 INTERVAL = 0.1
+WATCH_TIMEOUT = 1.0
+CHUNK_SIZE = 4 * 1024 * 1024
+MAX_FPS = 10
+CHECKPOINT_INTERVAL = 10.0
+OUTPUT_BATCH_SIZE = 64 * 1024
+MAX_CLIENT_BACKLOG = 4 * 1024 * 1024  # Event stream clients that fall further behind are disconnected
+
+
+class LineClassifier(object):
+    """Matches a logline against several record formats with a single precompiled regex."""
+
+    def __init__(self, formats):
+        # formats: (pattern, status class, loader, names) tuples, earlier ones take precedence
+        alternatives = []
+        self._formats = {}
+        group = 1
+        for i, (pattern, cls, loader, names) in enumerate(formats):
+            name = "f%d" % i
+            alternatives.append("(?P<%s>%s)" % (name, pattern))
+            count = re.compile(pattern).groups
+            self._formats[name] = (cls, loader, names, group, group + count)
+            group += count + 1
+        self.regex = re.compile("|".join(alternatives))
+
+    def match(self, logline):
+        m = self.regex.search(logline)
+        if m is None:
+            return None
+        # The enclosing named group is the last one to close, so lastgroup tells which format matched
+        cls, loader, _, first, last = self._formats[m.lastgroup]
+        return cls, loader, m.groups()[first:last]
+
+    def classify(self, logline, timestamp):
+        m = self.regex.search(logline)
+        if m is None:
+            return None
+        cls, loader, names, first, last = self._formats[m.lastgroup]
+        fields = m.groups()[first:last]
+        if names is None:
+            status = cls()
+            loader(status, fields, timestamp)
+        else:  # Only the key is decoded for now, the rest when the status is shown or compared
+            status = cls.__new__(cls)
+            status._load_key(fields)
+            status._raw = (loader, names, fields)
+        status.timestamp = timestamp
+        return status
+
+
+class LogStatus(object):
+    # Statuses are created for every parsed line and kept for every row of every node, so no __dict__
+    __slots__ = ("timestamp",  # Log timestamp of the line the status was parsed from
+                 "_raw")  # (loader, names, fields) of a status that was parsed lazily
+
+    # (pattern, loader[, names]) tuples, loader(self, fields, timestamp) gets the groups of the pattern. Formats with
+    # the names of the fields the groups go to are decoded lazily, the key fields must come first.
+    FORMATS = ()
+    KEY_FIELDS = ()  # Fields that identify the row of a table the status is for
+    MODULE = None  # Prefix of the name of the module that logs the status, None if any module may
+    LITERAL = None  # The message starts with this, the pre-filter for statuses that any module may log
+
+    @classmethod
+    def formats(cls):
+        return [(f[0], cls, f[1], f[2] if len(f) > 2 else None) for f in cls.FORMATS]
+
+    @classmethod
+    def field_names(cls):
+        if "_field_names" not in cls.__dict__:
+            cls._field_names = tuple(name for c in reversed(cls.__mro__) for name in c.__dict__.get("__slots__", ())
+                                     if not name.startswith("_"))
+        return cls._field_names
+
+    def _load_key(self, fields):
+        for name, value in zip(self.KEY_FIELDS, fields):
+            setattr(self, name, int(value))
+
+    def __getattr__(self, name):
+        # Only called for slots that are not set, the fields of a status that has not been decoded yet
+        if name == "_raw":
+            return None
+        raw = self._raw
+        if raw is None or name.startswith("__"):
+            raise AttributeError(name)
+        loader, _, fields = raw
+        timestamp = self.timestamp
+        self.__init__()
+        loader(self, fields, timestamp)
+        self.timestamp = timestamp
+        return object.__getattribute__(self, name)
+
+    def __getstate__(self):
+        # Stored decoded, the loaders can not be pickled
+        return self.to_dict()
+
+    def __setstate__(self, state):
+        if isinstance(state, tuple):  # Stored before statuses were decoded lazily
+            state = state[1]
+        for name, value in state.iteritems():
+            setattr(self, name, value)
+
+    @classmethod
+    def kind(cls):
+        return cls.__name__[:-len("Status")].lower()
+
+    def to_dict(self):
+        return dict((name, getattr(self, name)) for name in self.field_names())
+
+    @classmethod
+    def value_names(cls):
+        if "_value_names" not in cls.__dict__:
+            cls._value_names = tuple(name for name in cls.field_names() if name != "timestamp")
+            cls._values = operator.attrgetter(*cls._value_names)
+        return cls._value_names
+
+    def changes(self, old):
+        """Names of the fields that differ from an older status of the same row, None if there are no changes."""
+        names = self.value_names()
+        if old is None:
+            return list(names)
+        raw, raw_before = self._raw, old._raw
+        if raw is not None and raw_before is not None and raw[0] is raw_before[0]:
+            # A format prints the same values the same way, so the fields are compared without decoding them
+            if raw[2] == raw_before[2]:
+                return None
+            return [name for name, a, b in zip(raw[1], raw[2], raw_before[2]) if a != b]
+        new, before = self._values(self), self._values(old)
+        if new == before:
+            return None
+        if len(names) == 1:  # attrgetter of a single name does not return a tuple
+            return list(names)
+        return [name for name, a, b in zip(names, new, before) if a != b]
+
+    @classmethod
+    def classifier(cls):
+        if "_classifier" not in cls.__dict__:
+            cls._classifier = LineClassifier(cls.formats())
+        return cls._classifier
+
+    def parse(self, statusline, timestamp):
+        match = self.classifier().match(statusline)
+        if match is None:
+            return False
+        _, loader, fields = match
+        loader(self, fields, timestamp)
+        self.timestamp = timestamp
+        return True
 
 
-class AddressStatus(object):
+class AddressStatus(LogStatus):
+    __slots__ = ("addr", "boot")
+    MODULE = "binf"
 
     def __init__(self, addr=0):
+        self.timestamp = None
         self.addr = addr
         self.boot = None
 
-    def parse(self, statusline, timestamp):
-        # 2015-08-03T07:27:10.20Z 'I|binf:  22|TOS_NODE_ID EEA2 GUID 01A2EE0E 1500001D'
-        m = re.search("TOS_NODE_ID ([0-9A-F]*) GUID ([ 0-9A-F]*).*", statusline)
-        if m is not None:
-            self.addr = int(m.group(1), 16)
+    def _load(self, fields, timestamp):
+        self.addr = int(fields[0], 16)
+        try:
+            self.boot = calendar.timegm(datetime.datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S.%f").timetuple())
+        except ValueError:
             try:
-                self.boot = calendar.timegm(datetime.datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S.%f").timetuple())
+                self.boot = calendar.timegm(datetime.datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%S.%fZ").timetuple())
             except ValueError:
-                try:
-                    self.boot = calendar.timegm(datetime.datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%S.%fZ").timetuple())
-                except ValueError:
-                    self.boot = None
-            return True
+                self.boot = None
+
+    FORMATS = (
+        # 2015-08-03T07:27:10.20Z 'I|binf:  22|TOS_NODE_ID EEA2 GUID 01A2EE0E 1500001D'
+        (r"TOS_NODE_ID ([0-9A-F]*) GUID ([ 0-9A-F]*)", _load),
+    )
 
     def __str__(self):
         if self.boot is None:
@@ -42,17 +224,22 @@ class AddressStatus(object):
         return "%04X (uptime %s)" % (self.addr, uptime)
 
 
-class OutputStatus(object):
+class OutputStatus(LogStatus):
+    __slots__ = ("output",)
+    LITERAL = "output["
 
     def __init__(self, output=None):
+        self.timestamp = None
         self.output = output
 
-    def parse(self, statusline, timestamp):
+    def _load(self, fields, timestamp):
+        self.output = int(fields[0], 10)
+
+    FORMATS = (
         # 2016-05-31 08:07:07.933: I | dclc: 117 | output[100]
-        m = re.search("output\[\s*(-?[0-9]+)\].*", statusline)
-        if m is not None:
-            self.output = int(m.group(1), 10)
-            return True
+        (r"output\[\s*(-?[0-9]+)\]", _load,
+         ("output",)),
+    )
 
     def __str__(self):
         if self.output is None:
@@ -60,17 +247,22 @@ class OutputStatus(object):
         return "%3d" % (self.output)
 
 
-class InputStatus(object):
+class InputStatus(LogStatus):
+    __slots__ = ("input",)
+    LITERAL = "input["
 
     def __init__(self, input=None):
+        self.timestamp = None
         self.input = input
 
-    def parse(self, statusline, timestamp):
-        # 2016-05-31 08:07:07.933: I | dclc: 117 | output[100]
-        m = re.search("input\[\s*(-?[0-9]+)\].*", statusline)
-        if m is not None:
-            self.input = int(m.group(1), 10)
-            return True
+    def _load(self, fields, timestamp):
+        self.input = int(fields[0], 10)
+
+    FORMATS = (
+        # 2016-05-31 08:07:07.933: I | dclc: 117 | input[100]
+        (r"input\[\s*(-?[0-9]+)\]", _load,
+         ("input",)),
+    )
 
     def __str__(self):
         if self.input is None:
@@ -78,38 +270,40 @@ class InputStatus(object):
         return "%3d" % (self.input)
 
 
-class ManagerStatus(object):
+class ManagerStatus(LogStatus):
+    __slots__ = ("index", "priority", "len", "status", "stored", "max_timeout", "start", "streams")
+    KEY_FIELDS = ("index",)
+    MODULE = "sbslog"
 
     def __init__(self, index=None):
+        self.timestamp = None
         self.index = index
         self.priority = self.len = self.status = self.stored = self.max_timeout = self.start = self.streams = None
 
-    def parse(self, statusline, timestamp):
-        # 2015-07-31T14:21:46.93Z 'D|sbslog: 594|[01] --'
-        m = re.search("s\[([0-9]*)\] --.*", statusline)
-        if m is not None:
-            self.index = int(m.group(1))
-            return True
-
-        # 2016-04-07 13:00:57.468 : D|  sbslog:  23|s[00] p0 l33 (1|0) 14/3600
-        m = re.search("s\[([0-9]*)\] p([0-9]+) l([0-9]+) \(([0-9]+)\|([0-9]+)\) ([0-9]+)/([0-9]+) \(([0-9]+)\).*", statusline)
-        if m is not None:
-            # ('00', 'F802', '4', '0', '0', '637', '638', '637')
-            self.index = int(m.group(1))
-            self.priority = int(m.group(2))
-            self.len = int(m.group(3))
-            self.status = int(m.group(4))
-            self.stored = int(m.group(5))
-            self.start = int(m.group(6))
-            self.max_timeout = int(m.group(7))
-            self.streams = int(m.group(8))
+    def _load_empty(self, fields, timestamp):
+        self.index = int(fields[0])
 
-            if self.max_timeout == 0xFFFFFFFF:
-                self.max_timeout = "never"
+    def _load(self, fields, timestamp):
+        # ('00', 'F802', '4', '0', '0', '637', '638', '637')
+        self.index = int(fields[0])
+        self.priority = int(fields[1])
+        self.len = int(fields[2])
+        self.status = int(fields[3])
+        self.stored = int(fields[4])
+        self.start = int(fields[5])
+        self.max_timeout = int(fields[6])
+        self.streams = int(fields[7])
 
-            return True
+        if self.max_timeout == 0xFFFFFFFF:
+            self.max_timeout = "never"
 
-        return False
+    FORMATS = (
+        # 2015-07-31T14:21:46.93Z 'D|sbslog: 594|[01] --'
+        (r"s\[([0-9]*)\] --", _load_empty),
+        # 2016-04-07 13:00:57.468 : D|  sbslog:  23|s[00] p0 l33 (1|0) 14/3600
+        (r"s\[([0-9]*)\] p([0-9]+) l([0-9]+) \(([0-9]+)\|([0-9]+)\) ([0-9]+)/([0-9]+) \(([0-9]+)\)", _load,
+         ("index", "priority", "len", "status", "stored", "start", "max_timeout", "streams")),
+    )
 
     def __str__(self):
         if self.index is None:
@@ -120,44 +314,44 @@ class ManagerStatus(object):
             return "[%02u]%3u|%2u|%u|%u|%10u|%10s|%5u|" % (self.index, self.len, self.priority, self.status, self.stored, self.start, self.max_timeout, self.streams)
 
 
-class StreamStatus(object):
+class StreamStatus(LogStatus):
+    __slots__ = ("index", "lid", "mote", "cid", "slot", "status", "stored", "start",
+                 "contact", "maintenance", "data_out", "tstart", "tend")
+    KEY_FIELDS = ("index",)
+    MODULE = "sbslog"
 
     def __init__(self, index=None):
+        self.timestamp = None
         self.index = index
         self.lid = 0xFF
         self.mote = self.cid = self.slot = self.status = self.stored = self.start = None
         self.contact = self.maintenance = self.data_out = self.tstart = self.tend = None
 
-    def parse(self, statusline, timestamp):
+    def _load_empty(self, fields, timestamp):
+        self.index = int(fields[0])
+
+    def _load(self, fields, timestamp):
+        self.index = int(fields[0])
+        self.lid = int(fields[1])
+        self.mote = int(fields[2], 10)
+        self.cid = int(fields[3], 16)
+        self.slot = int(fields[4])
+        self.status = int(fields[5])
+        self.stored = int(fields[6])
+        self.start = int(fields[7])
+        self.contact = int(fields[8])
+        self.maintenance = int(fields[9])
+        self.data_out = int(fields[10])
+        self.tstart = int(fields[11])
+        self.tend = int(fields[12])
+
+    FORMATS = (
         # 2015-07-31T14:21:46.93Z 'D|sbslog: 594|[01] --'
-        m = re.search("t\[([0-9]*)\] --.*", statusline)
-        if m is not None:
-            self.index = int(m.group(1))
-            return True
-
+        (r"t\[([0-9]*)\] --", _load_empty),
         # 2016-04-07 14:55:47.107 : D|  sbslog:  35|t[00|00] m02:834e(0)(1|0) 14/14
-        m = re.search("t\[([0-9]+)\|([0-9]+)\] m([-0-9]+):([0-9a-f]+)\(([0-9]+)\)\(([0-9]+)\|([0-9]+)\) ([0-9]+)/([0-9]+)/([0-9]+)/([0-9]+) ([0-9]+)~([0-9]+).*", statusline)
-        if m is not None:
-            print "match", m.groups()
-            # ('00', 'F802', '4', '0', '0', '637', '638', '637')
-            self.index = int(m.group(1))
-            self.lid = int(m.group(2))
-            self.mote = int(m.group(3), 10)
-            self.cid = int(m.group(4), 16)
-            self.slot = int(m.group(5))
-            self.status = int(m.group(6))
-            self.stored = int(m.group(7))
-            self.start = int(m.group(8))
-            self.contact = int(m.group(9))
-            self.maintenance = int(m.group(10))
-            self.data_out = int(m.group(11))
-            self.tstart = int(m.group(12))
-            self.tend = int(m.group(13))
-            return True
-        else:
-            print "bad", statusline
-
-        return False
+        (r"t\[([0-9]+)\|([0-9]+)\] m([-0-9]+):([0-9a-f]+)\(([0-9]+)\)\(([0-9]+)\|([0-9]+)\) ([0-9]+)/([0-9]+)/([0-9]+)/([0-9]+) ([0-9]+)~([0-9]+)", _load,
+         ("index", "lid", "mote", "cid", "slot", "status", "stored", "start", "contact", "maintenance", "data_out", "tstart", "tend")),
+    )
 
     def __str__(self):
         if self.index is None:
@@ -170,37 +364,40 @@ class StreamStatus(object):
                                                                                      self.tstart, self.tend)
 
 
-class MiddlewareStatus(object):
+class MiddlewareStatus(LogStatus):
+    __slots__ = ("index", "addr", "state", "cid", "priority", "start", "last_broadcast", "max_timeout", "providers",
+                 "latest_data")
+    KEY_FIELDS = ("index",)
+    MODULE = "mddl"
 
     def __init__(self, index=None):
+        self.timestamp = None
         self.index = index
         self.addr = self.state = self.cid = self.priority = self.start = self.last_broadcast = self.max_timeout = self.providers = self.latest_data = None
 
-    def parse(self, statusline, timestamp):
-        m = re.search("\[([0-9]*)\] --.*", statusline)
-        if m is not None:
-            self.index = int(m.group(1))
-            return True
-
+    def _load_empty(self, fields, timestamp):
+        self.index = int(fields[0])
+
+    def _load(self, fields, timestamp):
+        self.index = int(fields[0])
+        self.state = int(fields[1])
+        self.cid = int(fields[2], 16)
+        self.priority = int(fields[3])
+        self.providers = int(fields[4])
+        self.start = int(fields[5])
+        self.last_broadcast = int(fields[6])
+        self.max_timeout = int(fields[7])
+        self.latest_data = int(fields[8])
+
+        if self.max_timeout == 0xFFFFFFFF:
+            self.max_timeout = "never"
+
+    FORMATS = (
+        (r"\[([0-9]*)\] --", _load_empty),
         #"[%02u] s%u i%u p%u b%"PRIu32" c%u"
-        m = re.search("\[([0-9]*)\] s([0-9]*) i([0-9a-f]+) p([0-9]+) c([0-9]+) ([0-9]+)/([0-9]+)/([0-9]+)/([0-9]+).*", statusline)
-        if m is not None:
-            self.index = int(m.group(1))
-            self.state = int(m.group(2))
-            self.cid = int(m.group(3), 16)
-            self.priority = int(m.group(4))
-            self.providers = int(m.group(5))
-            self.start = int(m.group(6))
-            self.last_broadcast = int(m.group(7))
-            self.max_timeout = int(m.group(8))
-            self.latest_data = int(m.group(9))
-
-            if self.max_timeout == 0xFFFFFFFF:
-                self.max_timeout = "never"
-
-            return True
-
-        return False
+        (r"\[([0-9]*)\] s([0-9]*) i([0-9a-f]+) p([0-9]+) c([0-9]+) ([0-9]+)/([0-9]+)/([0-9]+)/([0-9]+)", _load,
+         ("index", "state", "cid", "priority", "providers", "start", "last_broadcast", "max_timeout", "latest_data")),
+    )
 
     def __str__(self):
         if self.index is None:
@@ -213,41 +410,47 @@ class MiddlewareStatus(object):
                                                                    self.max_timeout, self.latest_data)
 
 
-class MiddlewareProviderStatus(object):
+class MiddlewareProviderStatus(LogStatus):
+    __slots__ = ("index", "mote", "expected", "stream", "start", "contact", "outgoing", "timeout", "live")
+    KEY_FIELDS = ("index", "mote")
+    MODULE = "mddl"
 
     def __init__(self, index=None):
+        self.timestamp = None
         self.index = index
         self.mote = self.expected = self.stream = self.start = self.contact = self.outgoing = self.timeout = None
         self.live = False
 
-    def parse(self, statusline, timestamp):
-        m = re.search("\[([0-9]*)\] m([0-9]+) --.*", statusline)
-        if m is not None:
-            self.index = int(m.group(1))
-            self.mote = int(m.group(2))
-            self.expected = self.stream = self.contact = self.outgoing = self.timeout = None
-            self.live = False
-            return True
+    def _load_empty(self, fields, timestamp):
+        self.index = int(fields[0])
+        self.mote = int(fields[1])
+        self.expected = self.stream = self.contact = self.outgoing = self.timeout = None
+        self.live = False
 
+    def _load(self, fields, timestamp):
+        self.index = int(fields[0])
+        self.mote = int(fields[1])
+        self.expected = int(fields[2])
+        self.stream = int(fields[3], 16)
+        self.start = int(fields[4])
+        self.contact = int(fields[5])
+        self.outgoing = int(fields[6])
+        self.timeout = int(fields[7])
+        self.live = True
+
+        if self.timeout == 0xFFFFFFFF:
+            self.timeout = "never"
+
+    def _load_key(self, fields):
+        LogStatus._load_key(self, fields)
+        self.live = True  # Only the format of a live provider is decoded lazily
+
+    FORMATS = (
+        (r"\[([0-9]*)\] m([0-9]+) --", _load_empty),
         # "[%02u] m%02d e%u s%02x %PRIu32/%PRIu32/%PRIu32"
-        m = re.search("\[([0-9]*)\] m([0-9]+) e([01]+) s([0-9a-f]+) ([0-9]+)/([0-9]+)/([0-9]+)/([0-9]+).*", statusline)
-        if m is not None:
-            self.index = int(m.group(1))
-            self.mote = int(m.group(2))
-            self.expected = int(m.group(3))
-            self.stream = int(m.group(4), 16)
-            self.start = int(m.group(5))
-            self.contact = int(m.group(6))
-            self.outgoing = int(m.group(7))
-            self.timeout = int(m.group(8))
-            self.live = True
-
-            if self.timeout == 0xFFFFFFFF:
-                self.timeout = "never"
-
-            return True
-
-        return False
+        (r"\[([0-9]*)\] m([0-9]+) e([01]+) s([0-9a-f]+) ([0-9]+)/([0-9]+)/([0-9]+)/([0-9]+)", _load,
+         ("index", "mote", "expected", "stream", "start", "contact", "outgoing", "timeout")),
+    )
 
     def __str__(self):
         if self.index is None:
@@ -258,29 +461,32 @@ class MiddlewareProviderStatus(object):
             return "   |%4u|%u|%2x|%10u|%10u|%10s|%10s|" % (self.mote, self.expected, self.stream, self.start, self.contact, self.outgoing, self.timeout)
 
 
-class SchedulerStatus(object):
+class SchedulerStatus(LogStatus):
+    __slots__ = ("index", "sensm", "lid", "state", "active")
+    KEY_FIELDS = ("index",)
+    MODULE = "amdl"
 
     def __init__(self, index=None):
+        self.timestamp = None
         self.index = index
         self.sensm = self.lid = self.state = self.active = None
 
-    def parse(self, statusline, timestamp):
-        m = re.search("\[([0-9]*)\]<-->.*", statusline)
-        if m is not None:
-            self.index = int(m.group(1))
-            return True
+    def _load_empty(self, fields, timestamp):
+        self.index = int(fields[0])
 
-        #debug3("[%02u](%2u) s%u "PRIu32"/%"PRIu32"/%"PRIu32"/%"PRIu32"/%"PRIu32,
-        m = re.search("\[([0-9]*)\]<([0-9]+)>\(([0-9]+)\) s([0-9]+) a([01]).*", statusline)
-        if m is not None:
-            self.index = int(m.group(1))
-            self.sensm = int(m.group(2))
-            self.lid = int(m.group(3))
-            self.state = int(m.group(4))
-            self.active = int(m.group(5))
-            return True
+    def _load(self, fields, timestamp):
+        self.index = int(fields[0])
+        self.sensm = int(fields[1])
+        self.lid = int(fields[2])
+        self.state = int(fields[3])
+        self.active = int(fields[4])
 
-        return False
+    FORMATS = (
+        (r"\[([0-9]*)\]<-->", _load_empty),
+        #debug3("[%02u](%2u) s%u "PRIu32"/%"PRIu32"/%"PRIu32"/%"PRIu32"/%"PRIu32,
+        (r"\[([0-9]*)\]<([0-9]+)>\(([0-9]+)\) s([0-9]+) a([01])", _load,
+         ("index", "sensm", "lid", "state", "active")),
+    )
 
     def __str__(self):
         if self.index is None:
@@ -291,24 +497,28 @@ class SchedulerStatus(object):
             return "[%02u|%02u] %2u|%2u%s|" % (self.index, self.sensm, self.lid, self.state, "*" if self.active else " ")
 
 
-class RegistryStatus(object):
+class RegistryStatus(LogStatus):
+    __slots__ = ("index", "addr", "guid", "count", "contact")
+    KEY_FIELDS = ("index",)
+    MODULE = "mreg"
 
     def __init__(self, index=None):
+        self.timestamp = None
         self.index = index
         self.addr = self.guid = self.count = self.contact = None
 
-    def parse(self, statusline, timestamp):
-        # "m%02d %04X c%u t%PRIu32"
-        m = re.search("m([0-9]+) ([0-9A-F]+) c([0-9]+) t([0-9]+) ([0-9a-fA-F]+) ([0-9a-fA-F]+).*", statusline)
-        if m is not None:
-            self.index = int(m.group(1))
-            self.addr = int(m.group(2), 16)
-            self.count = int(m.group(3))
-            self.contact = int(m.group(4))
-            self.guid = (m.group(5) + m.group(6)).upper()
-            return True
+    def _load(self, fields, timestamp):
+        self.index = int(fields[0])
+        self.addr = int(fields[1], 16)
+        self.count = int(fields[2])
+        self.contact = int(fields[3])
+        self.guid = fields[4].replace(" ", "").upper()
 
-        return False
+    FORMATS = (
+        # "m%02d %04X c%u t%PRIu32"
+        (r"m([0-9]+) ([0-9A-F]+) c([0-9]+) t([0-9]+) ([0-9a-fA-F]+ [0-9a-fA-F]+)", _load,
+         ("index", "addr", "count", "contact", "guid")),
+    )
 
     def __str__(self):
         if self.index is None:
@@ -319,213 +529,2059 @@ class RegistryStatus(object):
             return "[%02d]%s|%04X|%10u|%3u|" % (self.index, self.guid, self.addr, self.contact, self.count)
 
 
-def tail_file(file_path, seek=0, sim_filter=None):
-    logfile = open(file_path, "r")
-    logfile.seek(seek)
-    actual_path = None
-    if os.path.islink(file_path):
-        actual_path = os.readlink(file_path)
-
-    if sim_filter is not None:
-        sim_filter = "%04X" % int(sim_filter, 16)
-
-    where = logfile.tell()
-    while True:
-        if actual_path is not None:
-            new_path = os.readlink(file_path)
-            if new_path != actual_path:
-                actual_path = new_path
-                logfile.close()
-                logfile = open(file_path)
-                print "opened {}".format(actual_path)
-
-        if os.stat(file_path)[ST_SIZE] < where:
-            logfile.close()
-            logfile = open(file_path)
-
-        where = logfile.tell()
-        line = logfile.readline()
-        if line:
-            line = line.lstrip().rstrip()
-
-            if sim_filter is not None:  # Handle super long simulator log line
-                # 0:28:50.537109425 DEBUG (4): 2016-10-26 12:46:39 00:28:50.537109425 #0004
-                m = re.search(".* DEBUG \([0-9]*\): ([0-9]*-[0-9]*-[0-9]* [0-9]*:[0-9]*:[0-9]*) [0-9:\.]* #([0-9A-F]+)\s*[DIWE]\|\s*(.*):[ 0-9]*\|(.*)", line)
-                if m is None:
-                    continue
+# Every status that is parsed, statuses for the same module are tried in this order
+PARSERS = (ManagerStatus, StreamStatus, MiddlewareStatus, MiddlewareProviderStatus, SchedulerStatus, AddressStatus,
+           RegistryStatus, OutputStatus, InputStatus)
 
-                # Filter based on address
-                timestamp, address, module, logline = m.groups()
-                if address != sim_filter:
-                    continue
-            else:
-                m = re.search("(.*)[:']\s*[DIWE]\|(.*):[ 0-9]*\|(.*)", line)
-                if m is None:
-                    continue
-                timestamp, module, logline = m.groups()
 
-            module = module.strip()
-            timestamp = timestamp.strip()
-            logline.rstrip("'")
+def build_classifier(parsers):
+    formats = []
+    for cls in parsers:
+        formats.extend(cls.formats())
+    return LineClassifier(formats)
+
+
+class ParserRegistry(object):
+    """Finds the parsers for a line with dict lookups, lines that none of them handle are rejected without a scan.
+    Statuses of a particular module are looked up by module name, resolved once per distinct name to the longest
+    registered prefix. Statuses that any module may log are looked up by the first character of the message."""
+
+    def __init__(self, parsers=PARSERS):
+        self._modules = {}  # Module name prefix: status classes
+        self._literals = {}  # Literal: status classes
+        self._classifiers = {}  # Module name prefix: classifier
+        self._resolved = {}  # Module name: classifier or None
+        self._heads = {}  # First character of the message: (literal, classifier) pairs
+        for cls in parsers:
+            self.register(cls)
 
-            if module.startswith("sbslog"):
-                if logline.startswith("s"):
-                    parsers = (ManagerStatus(),)
-                elif logline.startswith("t"):
-                    parsers = (StreamStatus(),)
+    def register(self, cls):
+        if cls.MODULE is not None:
+            self._modules.setdefault(cls.MODULE, []).append(cls)
+        elif cls.LITERAL:
+            self._literals.setdefault(cls.LITERAL, []).append(cls)
+        else:
+            raise ValueError("{} has neither a MODULE nor a LITERAL".format(cls.__name__))
+
+        self._classifiers = {}
+        self._resolved = {}
+        self._heads = {}
+        for literal, parsers in self._literals.iteritems():
+            self._heads.setdefault(literal[0], []).append((literal, self._build(literal, parsers)))
+
+    def _build(self, name, parsers):
+        return build_classifier(parsers)
+
+    def classifier(self, module):
+        try:
+            return self._resolved[module]
+        except KeyError:
+            pass
+
+        classifier = None
+        for end in xrange(len(module), 0, -1):
+            prefix = module[:end]
+            if prefix in self._modules:
+                classifier = self._classifiers.get(prefix)
+                if classifier is None:
+                    classifier = self._classifiers[prefix] = self._build(prefix, self._modules[prefix])
+                break
+        self._resolved[module] = classifier
+        return classifier
+
+    def classify(self, module, logline, timestamp):
+        try:
+            classifier = self._resolved[module]
+        except KeyError:
+            classifier = self.classifier(module)
+        if classifier is not None:
+            return classifier.classify(logline, timestamp)
+
+        candidates = self._heads.get(logline[:1])
+        if candidates is None:
+            if logline[:1] != " ":
+                return None
+            logline = logline.lstrip()
+            candidates = self._heads.get(logline[:1])
+            if candidates is None:
+                return None
+        for literal, classifier in candidates:
+            if logline.startswith(literal):
+                return classifier.classify(logline, timestamp)
+        return None
+
+
+class CountingClassifier(object):
+    """Wraps a classifier, counts the lines it is given and the lines it rejects, and per status class the statuses
+    it returns and the time they take."""
+
+    def __init__(self, classifier, parsers):
+        self._classifier = classifier
+        self.lines = 0
+        self.rejected = 0
+        self.rejected_seconds = 0.0
+        self.matched = dict((cls, 0) for cls in parsers)
+        self.seconds = dict((cls, 0.0) for cls in parsers)
+
+    def classify(self, logline, timestamp):
+        start = time.time()
+        status = self._classifier.classify(logline, timestamp)
+        elapsed = time.time() - start
+        self.lines += 1
+        if status is None:
+            self.rejected += 1
+            self.rejected_seconds += elapsed
+        else:
+            cls = type(status)
+            self.matched[cls] = self.matched.get(cls, 0) + 1
+            self.seconds[cls] = self.seconds.get(cls, 0.0) + elapsed
+        return status
+
+
+class CountingRegistry(ParserRegistry):
+    """ParserRegistry with counters for every status class, costs a bit of time on every line so it is optional."""
+
+    def __init__(self, parsers=PARSERS):
+        self.lines = 0
+        self.counters = {}  # Module name prefix or literal: CountingClassifier
+        ParserRegistry.__init__(self, parsers)
+
+    def _build(self, name, parsers):
+        counter = self.counters.get(name)
+        if counter is None:
+            counter = self.counters[name] = CountingClassifier(build_classifier(parsers), parsers)
+        return counter
+
+    def classify(self, module, logline, timestamp):
+        self.lines += 1
+        return ParserRegistry.classify(self, module, logline, timestamp)
+
+    def parsers(self):
+        """(status class, lines given to its classifier, statuses, seconds) for every status class."""
+        return [(cls, c.lines, c.matched[cls], c.seconds[cls]) for c in self.counters.itervalues() for cls in c.matched]
+
+    def metrics(self):
+        parsers = dict((cls.__name__, {"lines": lines, "matched": matched, "seconds": round(seconds, 3)})
+                       for cls, lines, matched, seconds in self.parsers())
+        counters = self.counters.values()
+        return {"lines": self.lines, "unparsed": self.lines - sum(c.lines for c in counters),
+                "rejected": sum(c.rejected for c in counters),
+                "rejected_seconds": round(sum(c.rejected_seconds for c in counters), 3), "parsers": parsers}
+
+
+class PollingWatcher(object):
+    """Fallback for platforms without inotify, simply sleeps between checks."""
+
+    def watch(self, file_path):
+        pass
+
+    def wait(self, timeout=INTERVAL, readers=(), writers=()):
+        # Returns None, as there is no way of knowing which files changed
+        select.select(list(readers), list(writers), [], min(timeout, INTERVAL))
+        return None
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(object):
+    """Wakes up on modify, truncate and rotate events of the watched files."""
+
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+
+    FILE_EVENTS = IN_MODIFY | IN_ATTRIB | IN_DELETE_SELF | IN_MOVE_SELF
+    DIRECTORY_EVENTS = IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+    EVENT = struct.Struct("iIII")  # struct inotify_event without the name
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._fd = self._libc.inotify_init()
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init failed")
+        self._watches = {}  # path: wd
+        self._paths = {}  # wd: set of paths, a file may be watched through several names
+
+    def _add_watch(self, path, mask):
+        wd = self._libc.inotify_add_watch(self._fd, path, mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+
+        old = self._watches.get(path)
+        if old is not None and old != wd:  # File was replaced, drop the watch on the old inode
+            paths = self._paths.get(old, set())
+            paths.discard(path)
+            if not paths:
+                self._libc.inotify_rm_watch(self._fd, old)
+                self._paths.pop(old, None)
+        self._watches[path] = wd
+        self._paths.setdefault(wd, set()).add(path)
+
+    def watch(self, file_path):
+        # The directory is watched too, so that rotation and symlink changes are noticed
+        file_path = os.path.abspath(file_path)
+        self._add_watch(file_path, self.FILE_EVENTS)
+        self._add_watch(os.path.dirname(file_path), self.DIRECTORY_EVENTS)
+
+    def _read_events(self):
+        data = os.read(self._fd, 65536)
+        changed = set()
+        pos = 0
+        while pos + self.EVENT.size <= len(data):
+            wd, mask, _, length = self.EVENT.unpack_from(data, pos)
+            if mask & self.IN_Q_OVERFLOW:  # Events were dropped, any of the files may have changed
+                return None
+            pos += self.EVENT.size
+            name = data[pos:pos + length].rstrip("\0")
+            pos += length
+            for path in self._paths.get(wd, ()):
+                changed.add(os.path.join(path, name) if name else path)
+        return changed
+
+    def wait(self, timeout=WATCH_TIMEOUT, readers=(), writers=()):
+        """Wait for events, return the absolute paths that changed, or None on timeout or when events were lost."""
+        r, w, _ = select.select([self._fd] + list(readers), list(writers), [], timeout)
+        if self._fd in r:
+            return self._read_events()
+        if r or w:  # Only other input or output
+            return set()
+        return None
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def create_watcher():
+    try:
+        return InotifyWatcher()
+    except (OSError, AttributeError):
+        return PollingWatcher()
+
+
+# The manager table is dumped first, so a dump cycle starts with its first row
+CYCLE_MARKER = "|s[00] "
+BOOT_MARKER = "|TOS_NODE_ID "
+SIM_NODE = re.compile(r" #([0-9A-F]+)\s*[DIWE]\|")
+
+
+def restart_offset(file_path, end, window):
+    """Where the state of every node can be rebuilt from, looking at most window bytes back from end: the start of
+    the second last dump cycle, which is complete, or the last boot if it is later. Nodes that have neither in the
+    window can only be caught up from the first line of it."""
+    start = max(0, end - window)
+    first = start if start == 0 else None  # Offset of the first complete line
+    nodes = {}  # Address, None if not a simulator log: [second last cycle, last cycle, last boot]
+    with io.open(file_path, "rb", buffering=0) as logfile:
+        logfile.seek(start)
+        offset = start  # Of the start of data
+        pending = ""
+        remaining = end - start
+        while remaining > 0:
+            chunk = logfile.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            lines = (pending + chunk).split("\n")
+            pending = lines.pop()  # The last line may be incomplete
+            for line in lines:
+                if first is None:  # Skip the partial line
+                    first = offset + len(line) + 1
+                elif CYCLE_MARKER in line or BOOT_MARKER in line:
+                    m = SIM_NODE.search(line)
+                    node = nodes.setdefault(m.group(1) if m is not None else None, [None, None, None])
+                    if BOOT_MARKER in line:
+                        node[2] = offset
+                    else:
+                        node[0], node[1] = node[1], offset
+                offset += len(line) + 1
+
+    if first is None:  # No line ends in the window, there is nothing to restart from
+        return 0
+    restart = None
+    for cycle, _, boot in nodes.itervalues():
+        if boot is not None and (cycle is None or boot > cycle):
+            cycle = boot
+        if cycle is None:
+            return first
+        restart = cycle if restart is None else min(restart, cycle)
+    return restart if restart is not None else first
+
+
+class LogFollower(object):
+    """Iterates over the lines of a growing logfile, handles truncation and rotation.
+    With max_lag, it jumps ahead to where the state can be rebuilt from when more than max_lag bytes are waiting."""
+
+    def __init__(self, file_path, seek=0, watcher=None, on_idle=None, max_lag=None):
+        self.file_path = file_path
+        self.watch_path = os.path.abspath(file_path)
+        self.offset = seek  # Position right after the last line that has been returned
+        self.on_idle = on_idle  # Called when all data has been consumed, may return a timeout for the next wait
+        self.max_lag = max_lag
+        self.skips = 0
+        self.bytes_skipped = 0
+        self._own_watcher = watcher is None
+        self._watcher = watcher if watcher is not None else create_watcher()
+        self._logfile = None
+        self.inode = None
+        self._pending = ""
+        self.lines = 0
+        self.reads = 0
+        self.bytes_read = 0
+        try:
+            self._open(seek)
+        except (OSError, IOError):
+            self.close()
+            raise
+
+    def _open(self, seek):
+        if self._logfile is not None:
+            self._logfile.close()
+        self._logfile = io.open(self.file_path, "rb", buffering=0)  # Unbuffered, EOF is not sticky
+        self._logfile.seek(seek)
+        self.inode = os.fstat(self._logfile.fileno()).st_ino
+        self._pending = ""
+        self.offset = seek
+        self._watcher.watch(self.file_path)
+
+    def _rotated(self):
+        try:
+            return os.stat(self.file_path).st_ino != self.inode
+        except OSError as e:
+            if e.errno == errno.ENOENT:  # Rotation in progress, keep the old file until the new one appears
+                return False
+            raise
+
+    def read_lines(self):
+        """Return the complete lines that have been appended since the last call, up to CHUNK_SIZE bytes at a time."""
+        size = os.fstat(self._logfile.fileno()).st_size
+        if size < self._logfile.tell():  # Truncated
+            self._open(0)
+        elif self.max_lag is not None and size - self.offset > self.max_lag:
+            self._catch_up(size)
+
+        data = self._logfile.read(CHUNK_SIZE)
+        self.reads += 1
+        if not data:
+            if self._rotated():
+                self._open(0)
+                data = self._logfile.read(CHUNK_SIZE)
+                self.reads += 1
+            if not data:
+                return []
+
+        self.bytes_read += len(data)
+        lines = (self._pending + data).split("\n")
+        self._pending = lines.pop()
+        self.lines += len(lines)
+        return lines
+
+    def _catch_up(self, size):
+        # Half the limit is searched, so the lag is well under the limit again afterwards
+        restart = restart_offset(self.file_path, size, self.max_lag // 2)
+        if restart <= self.offset:
+            return
+        self._logfile.seek(restart)
+        self._pending = ""
+        self.skips += 1
+        self.bytes_skipped += restart - self.offset
+        self.offset = restart
+
+    def lag(self):
+        """Bytes in the file that have not been returned yet."""
+        return max(0, os.fstat(self._logfile.fileno()).st_size - self.offset)
+
+    def metrics(self):
+        return {"lines": self.lines, "reads": self.reads, "bytes_read": self.bytes_read, "offset": self.offset,
+                "lag": self.lag(), "skips": self.skips, "bytes_skipped": self.bytes_skipped}
+
+    def close(self):
+        if self._logfile is not None:
+            self._logfile.close()
+        if self._own_watcher:
+            self._watcher.close()
+
+    def __iter__(self):
+        while True:
+            lines = self.read_lines()
+            if lines:
+                for line in lines:
+                    self.offset += len(line) + 1
+                    yield line
+            else:
+                timeout = self.on_idle() if self.on_idle is not None else None
+                if timeout is None:
+                    self._watcher.wait()
                 else:
-                    continue
-            elif module.startswith("mddl"):
-                parsers = (MiddlewareStatus(), MiddlewareProviderStatus())
-            elif module.startswith("amdl"):
-                parsers = (SchedulerStatus(),)
-            elif module.startswith("binf"):
-                parsers = (AddressStatus(),)
-            elif module.startswith("mreg"):
-                parsers = (RegistryStatus(),)
+                    self._watcher.wait(timeout)
+
+
+
+class MultiLogFollower(object):
+    """Follows several logfiles in a single thread, yields (follower, line) pairs as data arrives.
+    A logfile that can not be opened or read is retried every RETRY_INTERVAL, the others are followed meanwhile.
+    on_error(file_path, error) is told when that happens, with None as the error once the file is back."""
+
+    RETRY_INTERVAL = 1.0
+
+    def __init__(self, file_paths, seek_to_end=False, watcher=None, on_idle=None, seeks=None, max_lag=None,
+                 on_error=None):
+        self._own_watcher = watcher is None
+        self._watcher = watcher if watcher is not None else create_watcher()
+        self.max_lag = max_lag
+        self.on_idle = on_idle
+        self.on_error = on_error
+        self.followers = []
+        self.failed = {}  # file_path: (offset, inode) to continue from if it is still the same file
+        self._retried = time.time()
+        for file_path in file_paths:
+            if seeks is not None and file_path in seeks:
+                seek = seeks[file_path]
             else:
-                if logline.find("output") >= 0:
-                    parsers = (OutputStatus(),)
-                elif logline.find("input") >= 0:
-                    parsers = (InputStatus(),)
+                try:
+                    seek = os.stat(file_path).st_size if seek_to_end else 0
+                except OSError:
+                    seek = 0  # Everything in it is new once it appears
+            self._add(file_path, seek, None)
+        self.readers = {}  # fd: callback, other input that should also wake up the loop
+        self.writers = {}  # fd: callback, output waiting for the fd to become writable
+
+    def _add(self, file_path, seek, inode):
+        try:
+            if inode is not None and os.stat(file_path).st_ino != inode:
+                seek = 0
+            follower = LogFollower(file_path, seek, watcher=self._watcher, max_lag=self.max_lag)
+        except (OSError, IOError) as e:
+            if file_path not in self.failed and self.on_error is not None:
+                self.on_error(file_path, e)
+            self.failed[file_path] = (seek, inode)
+            return None
+        self.followers.append(follower)  # The same list object all along, others keep a reference to it
+        if self.failed.pop(file_path, None) is not None and self.on_error is not None:
+            self.on_error(file_path, None)
+        return follower
+
+    def _fail(self, follower, e):
+        follower.close()
+        self.followers.remove(follower)
+        self.failed[follower.file_path] = (follower.offset, follower.inode)
+        if self.on_error is not None:
+            self.on_error(follower.file_path, e)
+
+    def _retry(self):
+        self._retried = time.time()
+        return filter(None, [self._add(file_path, seek, inode)
+                             for file_path, (seek, inode) in self.failed.items()])
+
+    def _poll_readers(self, timeout=0):
+        if self.readers or self.writers:
+            r, w, _ = select.select(self.readers.keys(), self.writers.keys(), [], timeout)
+            for fd in r:
+                if fd in self.readers:  # A callback may have removed it
+                    self.readers[fd]()
+            for fd in w:
+                if fd in self.writers:
+                    self.writers[fd]()
+
+    def close(self):
+        for follower in self.followers:
+            follower.close()
+        if self._own_watcher:
+            self._watcher.close()
+
+    def __iter__(self):
+        check = self.followers
+        while True:
+            if self.failed and time.time() - self._retried >= self.RETRY_INTERVAL:
+                added = self._retry()
+                if check is not self.followers:
+                    check = check + added
+            active = []
+            for follower in list(check):  # A follower that fails is removed from followers
+                try:
+                    lines = follower.read_lines()
+                except (OSError, IOError) as e:
+                    self._fail(follower, e)
+                    continue
+                if lines:
+                    active.append(follower)
+                    for line in lines:
+                        follower.offset += len(line) + 1
+                        yield follower, line
+            self._poll_readers()
+
+            if active:  # These may have more, the others are checked once the watcher reports them
+                changed = self._watcher.wait(0)  # Without waiting, a log that is always busy would starve the rest
+                if changed is None:
+                    check = self.followers
                 else:
-                    # print "useless", line
+                    check = active + [follower for follower in self.followers
+                                      if follower.watch_path in changed and follower not in active]
+                continue
+
+            timeout = self.on_idle() if self.on_idle is not None else None
+            if timeout is None:
+                timeout = WATCH_TIMEOUT if not self.failed else self.RETRY_INTERVAL
+            changed = self._watcher.wait(timeout, self.readers.keys(), self.writers.keys())
+            if changed is None:
+                check = self.followers
+            else:
+                check = [follower for follower in self.followers if follower.watch_path in changed]
+
+# 2016-04-07 13:00:57.468 : D|  sbslog:  23|s[00] p0 l33 (1|0) 14/3600
+LOG_LINE = re.compile(r"(.*)[:']\s*[DIWE]\|(.*):[ 0-9]*\|(.*)")
+# 0:28:50.537109425 DEBUG (4): 2016-10-26 12:46:39 00:28:50.537109425 #0004 D|sbslog:  23|s[00] --
+SIM_LOG_LINE = re.compile(r" DEBUG \([0-9]*\): ([0-9]*-[0-9]*-[0-9]* [0-9]*:[0-9]*:[0-9]*) [0-9:\.]* #([0-9A-F]+)\s*[DIWE]\|\s*(.*):[ 0-9]*\|(.*)")
+
+
+class LineParser(object):
+    """Splits loglines into timestamp, module and message and classifies the message."""
+
+    def __init__(self, sim_filter=None, registry=None, sim_demux=False):
+        self.registry = registry if registry is not None else ParserRegistry()
+        self.sim_filter = None if sim_filter is None else "%04X" % int(sim_filter, 16)
+        self.simulator = sim_demux or self.sim_filter is not None
+        self.address = None  # Node of the last simulator line that was parsed
+
+        # Simulator logs interleave all nodes, lines of other nodes are dropped before any regex runs
+        self._sim_tag = None if self.sim_filter is None else "#" + self.sim_filter
+
+    def parse(self, line):
+        line = line.strip()
+        if not line:
+            return None
+
+        if self.simulator:  # Handle super long simulator log line
+            if self._sim_tag is not None and self._sim_tag not in line:
+                return None
+
+            # 0:28:50.537109425 DEBUG (4): 2016-10-26 12:46:39 00:28:50.537109425 #0004
+            m = SIM_LOG_LINE.search(line)
+            if m is None:
+                return None
+
+            # Filter based on address
+            timestamp, address, module, logline = m.groups()
+            if self.sim_filter is not None and address != self.sim_filter:
+                return None
+            self.address = address
+        else:
+            m = LOG_LINE.match(line)
+            if m is None:
+                return None
+            timestamp, module, logline = m.groups()
+
+        return self.registry.classify(module.strip(), logline.rstrip("'"), timestamp.strip())
+
+
+def parse_lines(lines, sim_filter=None, registry=None, sim_demux=False, parser=None):
+    if parser is None:
+        parser = LineParser(sim_filter, registry, sim_demux)
+    parse = parser.parse
+    for line in lines:
+        status = parse(line)
+        if status is not None:
+            yield status
+
+
+def tail_file(file_path, seek=0, sim_filter=None, on_idle=None):
+    return parse_lines(LogFollower(file_path, seek, on_idle=on_idle), sim_filter)
+
+
+class CorrelationIndex(object):
+    """Rows of the tables that refer to a mote, a cid or a GUID, kept up to date as the rows change so that tracing a
+    mote or a cid does not have to look through every table. Registry rows are indexed by mote already.
+    The changes given with a row are the names of its changed fields, rows where none of the indexed ones changed are
+    skipped without decoding them."""
+
+    def __init__(self):
+        self.mote_streams = {}  # mote: stream indexes
+        self.mote_providers = {}  # mote: indexes of the middleware the mote is a live provider of
+        self.cid_streams = {}
+        self.cid_middleware = {}
+        self.guid_registry = {}  # GUID: motes
+
+    @staticmethod
+    def _move(index, old, new, row):
+        if old == new:
+            return
+        if old is not None:
+            rows = index.get(old)
+            if rows is not None:
+                rows.discard(row)
+                if not rows:
+                    del index[old]
+        if new is not None:
+            index.setdefault(new, set()).add(row)
+
+    def stream(self, old, new, changes=None):
+        if changes is None or "mote" in changes or "cid" in changes:
+            self._move(self.mote_streams, old and old.mote, new.mote, new.index)
+            self._move(self.cid_streams, old and old.cid, new.cid, new.index)
+
+    def middleware(self, old, new, changes=None):
+        if changes is None or "cid" in changes:
+            self._move(self.cid_middleware, old and old.cid, new.cid, new.index)
+
+    def provider(self, old, new, changes=None):
+        self._move(self.mote_providers, old and old.mote, new.mote if new.live else None, new.index)
+
+    def registry(self, old, new, changes=None):
+        if changes is None or "guid" in changes:
+            self._move(self.guid_registry, old and old.guid, new.guid, new.index)
+
+    @classmethod
+    def build(cls, state):
+        index = cls()
+        for row in state.streammap.itervalues():
+            index.stream(None, row)
+        for row in state.middlewaremap.itervalues():
+            index.middleware(None, row)
+        for providers in state.middlewareproviders.itervalues():
+            for row in providers.itervalues():
+                index.provider(None, row)
+        for row in state.registrystatus.itervalues():
+            index.registry(None, row)
+        return index
+
+
+def query_value(field, value):
+    """Value of a --mote, --cid or --guid query as it is in the status fields."""
+    if field == "mote":
+        return int(value, 10)
+    if field == "cid":
+        return int(value, 16)
+    return value.upper()
+
+
+class SubsmanagerState(object):
+    """Subscription manager tables reconstructed from the parsed status lines."""
+
+    SECTIONS = ("managers", "streams", "middleware", "schedulers", "registry", "io")
+
+    def __init__(self):
+        self.addr = AddressStatus()
+        self.timestamp = None  # Of the last update
+        self.reset()
+
+    def reset(self):
+        self.managermap = {0: ManagerStatus(0)}
+        self.streammap = {0: StreamStatus(0)}
+        self.middlewaremap = {0: MiddlewareStatus(0)}
+        self.middlewareproviders = {}
+        self.schedulermap = {0: SchedulerStatus(0)}
+        self.registrystatus = {0: RegistryStatus(0)}
+        self.outputstatus = OutputStatus()
+        self.inputstatus = InputStatus()
+        self.correlation = CorrelationIndex()
+        self._sections = {}  # Rendered rows of the sections that have not changed since
+
+    def _apply(self, table, key, status, section, index):
+        # Dumps repeat every row all the time, only rows that really changed are stored and re-rendered
+        old = table.get(key)
+        changes = status.changes(old)
+        if changes is not None:
+            table[key] = status
+            self._sections.pop(section, None)
+            index(old, status, changes)
+        return changes
+
+    def update(self, status):
+        """Apply a status, returns the names of the fields that changed, or None if nothing did."""
+        self.timestamp = status.timestamp
+        if isinstance(status, ManagerStatus):
+            return self._apply(self.managermap, status.index, status, "managers", self._unindexed)
+        elif isinstance(status, StreamStatus):
+            return self._apply(self.streammap, status.index, status, "streams", self.correlation.stream)
+        elif isinstance(status, MiddlewareStatus):
+            return self._apply(self.middlewaremap, status.index, status, "middleware", self.correlation.middleware)
+        elif isinstance(status, MiddlewareProviderStatus):
+            if status.index not in self.middlewareproviders:
+                self.middlewareproviders[status.index] = {}
+            if status.live:
+                return self._apply(self.middlewareproviders[status.index], status.mote, status, "middleware",
+                                   self.correlation.provider)
+            old = self.middlewareproviders[status.index].pop(status.mote, None)
+            if old is not None:
+                self.correlation.provider(old, status)
+                self._sections.pop("middleware", None)
+                return ["live"]
+            return None
+        elif isinstance(status, SchedulerStatus):
+            return self._apply(self.schedulermap, status.index, status, "schedulers", self._unindexed)
+        elif isinstance(status, RegistryStatus):
+            return self._apply(self.registrystatus, status.index, status, "registry", self.correlation.registry)
+        elif isinstance(status, AddressStatus):  # Node booted, all tables start from scratch
+            self.addr = status
+            self.reset()
+            return status.changes(None)
+        elif isinstance(status, OutputStatus):
+            changes = status.changes(self.outputstatus)
+            if changes is not None:
+                self.outputstatus = status
+                self._sections.pop("io", None)
+            return changes
+        elif isinstance(status, InputStatus):
+            changes = status.changes(self.inputstatus)
+            if changes is not None:
+                self.inputstatus = status
+                self._sections.pop("io", None)
+            return changes
+        return None
+
+    @staticmethod
+    def _unindexed(old, new, changes=None):
+        pass
+
+    def _render_managers(self):
+        lines = [str(ManagerStatus())]
+        for i in xrange(0, max(self.managermap.iterkeys())+1):
+            if i not in self.managermap:
+                self.managermap[i] = ManagerStatus(i)
+            lines.append(str(self.managermap[i]))
+        return lines
+
+    def _render_streams(self):
+        lines = ["", str(StreamStatus())]
+        for i in xrange(0, max(self.streammap.iterkeys())+1):
+            if i not in self.streammap:
+                self.streammap[i] = StreamStatus(i)
+            lines.append(str(self.streammap[i]))
+        return lines
+
+    def _render_middleware(self):
+        lines = ["", str(MiddlewareStatus())]
+        previous_had_providers = False
+        for i in xrange(0, max(self.middlewaremap.iterkeys())+1):
+            if i in self.middlewaremap:
+                if previous_had_providers:
+                    lines.append("")
+                    lines.append(str(MiddlewareStatus()))
+                lines.append(str(self.middlewaremap[i]))
+                if i in self.middlewareproviders:
+                    if len(self.middlewareproviders[i]) > 0:
+                        lines.append(str(MiddlewareProviderStatus()))
+                        for k in sorted(self.middlewareproviders[i].keys()):
+                            lines.append(str(self.middlewareproviders[i][k]))
+                        previous_had_providers = True
+                        continue
+                    else:
+                        del self.middlewareproviders[i]
+
+            previous_had_providers = False
+        return lines
+
+    def _render_schedulers(self):
+        lines = ["", str(SchedulerStatus())]
+        for i in xrange(0, max(self.schedulermap.iterkeys())+1):
+            if i not in self.schedulermap:
+                self.schedulermap[i] = SchedulerStatus(i)
+            lines.append(str(self.schedulermap[i]))
+        return lines
+
+    def _render_registry(self):
+        lines = ["", str(RegistryStatus())]
+        for i in xrange(0, max(self.registrystatus.iterkeys())+1):
+            if i not in self.registrystatus:
+                self.registrystatus[i] = RegistryStatus(i)
+            lines.append(str(self.registrystatus[i]))
+        return lines
+
+    def _render_io(self):
+        return ["", "Output {}".format(self.outputstatus), "Input  {}".format(self.inputstatus)]
+
+    def render(self):
+        lines = [str(self.addr), ""]  # Uptime changes all the time, not cached
+        for name in self.SECTIONS:
+            rows = self._sections.get(name)
+            if rows is None:
+                rows = self._sections[name] = getattr(self, "_render_" + name)()
+            lines.extend(rows)
+        return lines
+
+    def __str__(self):
+        return "\n".join(self.render())
+
+    def _trace_mote(self, mote):
+        index = self.correlation
+        lines = ["", str(RegistryStatus())]
+        registry = self.registrystatus.get(mote)
+        if registry is not None and registry.addr is not None:
+            lines.append(str(registry))
+        lines.extend(["", str(StreamStatus())])
+        lines.extend(str(self.streammap[i]) for i in sorted(index.mote_streams.get(mote, ())))
+        lines.extend(["", str(MiddlewareStatus())])
+        for i in sorted(index.mote_providers.get(mote, ())):
+            lines.append(str(self.middlewaremap.get(i) or MiddlewareStatus(i)))
+            lines.append(str(MiddlewareProviderStatus()))
+            lines.append(str(self.middlewareproviders[i][mote]))
+        return lines
+
+    def _trace_cid(self, cid):
+        index = self.correlation
+        lines = ["", str(StreamStatus())]
+        lines.extend(str(self.streammap[i]) for i in sorted(index.cid_streams.get(cid, ())))
+        lines.extend(["", str(MiddlewareStatus())])
+        for i in sorted(index.cid_middleware.get(cid, ())):
+            lines.append(str(self.middlewaremap[i]))
+            providers = self.middlewareproviders.get(i)
+            if providers:
+                lines.append(str(MiddlewareProviderStatus()))
+                lines.extend(str(providers[mote]) for mote in sorted(providers))
+        return lines
+
+    def trace(self, field, value):
+        """The rows that refer to a mote, a cid or a GUID, looked up from the correlation index."""
+        lines = [str(self.addr), ""]
+        if field == "mote":
+            lines.append("mote %d" % value)
+            lines.extend(self._trace_mote(value))
+        elif field == "cid":
+            lines.append("cid %x" % value)
+            lines.extend(self._trace_cid(value))
+        else:
+            motes = sorted(self.correlation.guid_registry.get(value, ()))
+            lines.append("GUID %s: %s" % (value, ", ".join("mote %d" % mote for mote in motes) or "not registered"))
+            for mote in motes:
+                lines.extend(self._trace_mote(mote))
+        return lines
+
+    def to_dict(self):
+        def rows(table):
+            return [table[key].to_dict() for key in sorted(table)]
+        return {"address": self.addr.to_dict(), "timestamp": self.timestamp,
+                "managers": rows(self.managermap), "streams": rows(self.streammap),
+                "middleware": rows(self.middlewaremap),
+                "providers": [p for i in sorted(self.middlewareproviders) for p in rows(self.middlewareproviders[i])],
+                "schedulers": rows(self.schedulermap), "registry": rows(self.registrystatus),
+                "output": self.outputstatus.to_dict(), "input": self.inputstatus.to_dict()}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_sections"]  # Rendered rows are not worth storing
+        state.pop("correlation", None)  # Neither is what can be rebuilt from the tables
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._sections = {}
+        self.correlation = CorrelationIndex.build(self)
+
+    SUMMARY_HEADER = "node (uptime)           |mgrs|strms|  mw|prvd|regs|_last_update___________|"
+
+    def summary(self):
+        managers = sum(1 for m in self.managermap.itervalues() if m.len is not None)
+        streams = sum(1 for t in self.streammap.itervalues() if t.mote is not None)
+        middleware = sum(1 for m in self.middlewaremap.itervalues() if m.state is not None)
+        providers = sum(len(p) for p in self.middlewareproviders.itervalues())
+        registry = sum(1 for r in self.registrystatus.itervalues() if r.addr is not None)
+        return "%-24s|%4u|%5u|%4u|%4u|%4u|%-23s|" % (self.addr, managers, streams, middleware, providers, registry,
+                                                     self.timestamp or "")
+
+
+class Dashboard(object):
+    """States of several logs, shows one of them or a summary of all of them."""
+
+    def __init__(self, names=()):
+        self.names = []
+        self.states = {}
+        self.sources = {}  # Logfile: names of the states that are parsed from it
+        for name in names:
+            self.add(name, name)
+        self.selected = 0 if len(self.names) == 1 else None  # None for the summary
+        self.query = None  # (field, value) to show only the rows that refer to a mote, a cid or a GUID
+        self.errors = {}  # Logfile: why it can not be followed right now
+
+    def add(self, name, source, state=None):
+        if name not in self.states:
+            self.names.append(name)
+            self.sources.setdefault(source, []).append(name)
+        self.states[name] = state if state is not None else SubsmanagerState()
+
+    def update(self, name, status, source=None):
+        """Returns the names of the fields that changed, or None if nothing did."""
+        if name not in self.states:  # New node in a demultiplexed simulator log
+            self.add(name, source if source is not None else name)
+        # Applied whether or not the node is shown, the first status of a node is usually its boot line
+        return self.states[name].update(status)
+
+    def visible(self, name):
+        return self.selected is None or self.names[self.selected] == name
+
+    def key(self, key):
+        if not self.names:
+            return
+        if key in "\tn ":
+            self.selected = 0 if self.selected is None else (self.selected + 1) % len(self.names)
+        elif key == "p":
+            self.selected = len(self.names) - 1 if self.selected is None else (self.selected - 1) % len(self.names)
+        elif key in "s0":
+            self.selected = None
+        elif key.isdigit() and int(key) <= len(self.names):
+            self.selected = int(key) - 1
+
+    def render(self):
+        errors = ["Error: %s: %s" % item for item in sorted(self.errors.iteritems())]
+        if errors:
+            errors.append("")
+        if self.selected is None:
+            lines = ["%d logs, n/p/1-9 to select, s for summary" % len(self.names), "",
+                     "[ #]%-40s|%s" % ("_log_", SubsmanagerState.SUMMARY_HEADER)]
+            for i, name in enumerate(self.names):
+                lines.append("[%2d]%-40s|%s" % (i + 1, name[-40:], self.states[name].summary()))
+            return errors + lines
+
+        name = self.names[self.selected]
+        state = self.states[name]
+        lines = state.render() if self.query is None else state.trace(*self.query)
+        if len(self.names) > 1:
+            lines = ["[%d/%d] %s" % (self.selected + 1, len(self.names), name), ""] + lines
+        return errors + lines
+
+
+def status_record(source, status, changes=None):
+    """The whole status, or only the changed fields and the fields that identify the row, as a dict."""
+    if changes is None:
+        record = status.to_dict()
+    else:
+        record = dict((name, getattr(status, name)) for name in status.KEY_FIELDS)
+        for name in changes:
+            record[name] = getattr(status, name)
+        record["timestamp"] = status.timestamp
+    record["type"] = status.kind()
+    record["source"] = source
+    return record
+
+
+class RecordWriter(object):
+    """Writes every status as a compact record, JSON Lines or length prefixed, in buffered batches."""
+
+    def __init__(self, output, binary=False, batch_size=OUTPUT_BATCH_SIZE):
+        self.output = output
+        self.binary = binary  # 4 byte big endian length followed by the JSON record, no newline
+        self.batch_size = batch_size
+        self._encode = json.JSONEncoder(separators=(",", ":")).encode
+        self._buffer = []
+        self._size = 0
+
+    def write(self, source, status, changes=None):
+        data = self._encode(status_record(source, status, changes))
+        if self.binary:
+            self._buffer.append(struct.pack(">I", len(data)))
+        else:
+            data += "\n"
+        self._buffer.append(data)
+        self._size += len(data)
+        if self._size >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self.output.write("".join(self._buffer))
+            self._buffer = []
+            self._size = 0
+        self.output.flush()
+
+
+class StatusServer(object):
+    """Serves the dashboard over HTTP from the select loop of the follower, so any number of clients share one parser.
+    GET /state returns a JSON snapshot of all states, GET /events is a server-sent event stream that starts with
+    a snapshot event and continues with a record for every change. GET /metrics has the --stats counters.
+    Pages from other origins can read them only if allow_origin is given."""
+
+    MAX_REQUEST = 16 * 1024
+    OUT_OF_RESOURCES = (errno.EMFILE, errno.ENFILE, errno.ENOBUFS, errno.ENOMEM)
+
+    def __init__(self, address, dashboard, max_backlog=MAX_CLIENT_BACKLOG, allow_origin=None):
+        self.dashboard = dashboard
+        self.max_backlog = max_backlog
+        self._headers = "Access-Control-Allow-Origin: %s\r\n" % allow_origin if allow_origin else ""
+        self._encode = json.JSONEncoder(separators=(",", ":")).encode
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind(address)
+        self._socket.listen(64)
+        self._socket.setblocking(0)
+        self._connections = {}  # fd: [socket, received request or pending output, is an event stream]
+        self._streams = set()  # fds of the event stream clients
+        self._readers = self._writers = None
+        self.metrics = None  # Returns a dict for GET /metrics
+        self.on_error = None  # Called with the error when accepting fails, with None when accepting again
+        self._paused = False
+
+    def attach(self, readers, writers):
+        """Hook into the fd callback dicts of a MultiLogFollower, connections made through earlier ones are dropped."""
+        for fd in self._connections.keys():
+            self._close(fd)
+        self._readers = readers
+        self._writers = writers
+        self._paused = False
+        readers[self._socket.fileno()] = self._accept
+
+    def _accept(self):
+        try:
+            conn, _ = self._socket.accept()
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR, errno.ECONNABORTED, errno.EPROTO):
+                return
+            if e.errno in self.OUT_OF_RESOURCES:  # The connection stays pending, stop polling until something is freed
+                self._readers.pop(self._socket.fileno(), None)
+                self._paused = True
+            if self.on_error is not None:
+                self.on_error(e)
+            else:
+                sys.stderr.write("Error: accept: {}\n".format(e))
+            return
+        conn.setblocking(0)
+        fd = conn.fileno()
+        self._connections[fd] = [conn, "", False]
+        self._readers[fd] = lambda: self._receive(fd)
+
+    def _close(self, fd):
+        conn = self._connections.pop(fd)[0]
+        self._streams.discard(fd)
+        self._readers.pop(fd, None)
+        self._writers.pop(fd, None)
+        conn.close()
+        self._resume()
+
+    def _resume(self):
+        if self._paused and self._readers is not None:
+            self._paused = False
+            self._readers[self._socket.fileno()] = self._accept
+            if self.on_error is not None:
+                self.on_error(None)
+
+    def _receive(self, fd):
+        connection = self._connections[fd]
+        try:
+            data = connection[0].recv(4096)
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            data = ""
+        if not data:  # Client has gone away
+            self._close(fd)
+            return
+        if fd in self._streams:  # Nothing more is expected from event stream clients
+            return
+        request = connection[1] + data
+        if "\r\n\r\n" not in request and "\n\n" not in request:
+            if len(request) > self.MAX_REQUEST:
+                self._close(fd)
+            else:
+                connection[1] = request
+            return
+
+        connection[1] = ""
+        words = request.split("\n", 1)[0].split()
+        path = words[1].split("?", 1)[0] if len(words) >= 2 else None
+        if not words or words[0] != "GET":
+            self._respond(fd, "405 Method Not Allowed", "text/plain", "GET only\n")
+        elif path == "/state":
+            self._respond(fd, "200 OK", "application/json", self._snapshot())
+        elif path == "/metrics" and self.metrics is not None:
+            self._respond(fd, "200 OK", "application/json", self._encode(self.metrics()))
+        elif path == "/events":
+            self._streams.add(fd)
+            self._send(fd, "HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+                           "%s\r\nevent: snapshot\ndata: %s\n\n" % (self._headers, self._snapshot()))
+        else:
+            self._respond(fd, "404 Not Found", "text/plain", "/state or /events\n")
+
+    def _snapshot(self):
+        return self._encode(dict((name, state.to_dict()) for name, state in self.dashboard.states.iteritems()))
+
+    def _respond(self, fd, status, content_type, body):
+        self._connections[fd][2] = True  # Close when sent
+        self._send(fd, "HTTP/1.1 %s\r\nContent-Type: %s\r\nContent-Length: %d\r\nConnection: close\r\n"
+                       "%s\r\n%s" % (status, content_type, len(body), self._headers, body))
+
+    def _send(self, fd, data):
+        connection = self._connections[fd]
+        if connection[1]:  # Already waiting for the socket, keep the order
+            if len(connection[1]) + len(data) > self.max_backlog:  # Too slow, it can reconnect for a new snapshot
+                self._close(fd)
+            else:
+                connection[1] += data
+            return
+        try:
+            sent = connection[0].send(data)
+        except socket.error as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                self._close(fd)
+                return
+            sent = 0
+        if sent < len(data):
+            connection[1] = data[sent:]
+            self._writers[fd] = lambda: self._drain(fd)
+        elif connection[2]:
+            self._close(fd)
+
+    def _drain(self, fd):
+        connection = self._connections[fd]
+        try:
+            sent = connection[0].send(connection[1])
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            self._close(fd)
+            return
+        connection[1] = connection[1][sent:]
+        if not connection[1]:
+            del self._writers[fd]
+            if connection[2]:
+                self._close(fd)
+
+    def publish(self, source, status, changes=None):
+        """Send a change to the event stream clients."""
+        self._resume()  # Out of resources earlier, maybe not any more
+        if not self._streams:
+            return
+        data = "data: %s\n\n" % self._encode(status_record(source, status, changes))
+        for fd in list(self._streams):
+            self._send(fd, data)
+
+    def close(self):
+        for fd in self._connections.keys():
+            self._close(fd)
+        if self._readers is not None:
+            self._readers.pop(self._socket.fileno(), None)
+        self._socket.close()
+
+
+def listen_address(value):
+    """[host:]port, the host defaults to localhost."""
+    host, _, port = value.rpartition(":")
+    try:
+        return host or "127.0.0.1", int(port)
+    except ValueError:
+        raise ArgumentTypeError("expected [host:]port, got {}".format(value))
+
+
+class HistoryStore(object):
+    """Appends the counters of stream, provider and registry rows to column files, a directory per table and a file
+    per column, so that long histories can be queried with numpy without parsing the logs again. time is float64
+    seconds since the epoch, the other columns are int64 in native byte order, the firmware prints the counters as
+    uint32, NONE where there is no value and NEVER for timeouts that do not expire. Rows are buffered and appended in
+    batches."""
+
+    NONE = -1
+    NEVER = -2
+    INT = "l"  # 64 bit on the platforms this runs on, the size is in the file names anyway
+    TABLES = (
+        (StreamStatus, "streams", ("index", "mote", "contact", "maintenance", "data_out")),
+        (MiddlewareProviderStatus, "providers", ("index", "mote", "live", "contact", "outgoing", "timeout")),
+        (RegistryStatus, "registry", ("index", "addr", "count", "contact")),
+    )
+
+    def __init__(self, directory, batch_rows=65536):
+        self.directory = directory
+        self.batch_rows = batch_rows
+        self._tables = {}  # Status class: (directory, fields getter, field arrays, {column: array})
+        self._rows = 0
+        self._second = None  # Timestamp up to the seconds and its epoch time, lines of the same second are common
+        self._second_epoch = None
+        for cls, name, fields in self.TABLES:
+            path = os.path.join(directory, name)
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            columns = dict((column, array.array("d" if column == "time" else self.INT)) for column in ("time", "node") + fields)
+            self._tables[cls] = (path, operator.attrgetter(*fields), [columns[field] for field in fields], columns)
+            self._widen(path, columns)
+            self._repair(path, columns)
+
+    @staticmethod
+    def column_path(path, column, itemsize):
+        return os.path.join(path, "%s.%s%d" % (column, "f" if column == "time" else "i", itemsize))
+
+    def _widen(self, path, columns):
+        # Stores from before the counters got 64 bit columns have 32 bit ones
+        for column, values in columns.iteritems():
+            old = self.column_path(path, column, 4)
+            new = self.column_path(path, column, values.itemsize)
+            if old == new or not os.path.exists(old) or os.path.exists(new):
+                continue
+            narrow = array.array("i")
+            with open(old, "rb") as f:
+                narrow.fromstring(f.read())
+            with open(new, "wb") as f:
+                array.array(values.typecode, narrow).tofile(f)
+            os.remove(old)
+
+    def _repair(self, path, columns):
+        # An interrupted append may have left some columns longer than others
+        files = dict((self.column_path(path, column, values.itemsize), values.itemsize)
+                     for column, values in columns.iteritems())
+        rows = min(os.path.getsize(f) // size if os.path.exists(f) else 0 for f, size in files.iteritems())
+        for f, size in files.iteritems():
+            if os.path.exists(f) and os.path.getsize(f) != rows * size:
+                with open(f, "r+b") as column:
+                    column.truncate(rows * size)
+
+    def _epoch(self, timestamp):
+        second = timestamp[:19]
+        try:
+            if second != self._second:
+                self._second_epoch = calendar.timegm(time.strptime(second.replace("T", " "), "%Y-%m-%d %H:%M:%S"))
+                self._second = second
+            fraction = timestamp[20:].rstrip("Z")
+            return self._second_epoch + (float("0." + fraction) if fraction else 0.0)
+        except ValueError:
+            return float("nan")
+
+    def _value(self, value):
+        if value is None:
+            return self.NONE
+        if value == "never":
+            return self.NEVER
+        return int(value)
+
+    def append(self, node, status):
+        table = self._tables.get(type(status))
+        if table is None:
+            return
+        _, getter, arrays, columns = table
+        rows = len(columns["time"])
+        try:
+            for values, value in zip(arrays, getter(status)):
+                values.append(value if type(value) is int else self._value(value))
+        except OverflowError:  # Only a garbled line has a number that big, the row is dropped
+            for values in arrays:
+                del values[rows:]
+            return
+        columns["time"].append(self._epoch(status.timestamp) if status.timestamp else float("nan"))
+        columns["node"].append(node)
+        self._rows += 1
+        if self._rows >= self.batch_rows:
+            self.flush()
+
+    def flush(self):
+        if not self._rows:
+            return
+        for path, _, _, columns in self._tables.itervalues():
+            for column, values in columns.iteritems():
+                if values:
+                    with open(self.column_path(path, column, values.itemsize), "ab") as f:
+                        values.tofile(f)
+                    del values[:]
+        self._rows = 0
+
+
+def store_node(state, address):
+    """Node of a status for the HistoryStore, simulator lines tell it, otherwise it is known after the boot marker."""
+    return int(address, 16) if address is not None else state.addr.addr
+
+
+def terminal_size(fd):
+    try:
+        rows, columns, _, _ = struct.unpack("HHHH", fcntl.ioctl(fd, termios.TIOCGWINSZ, struct.pack("HHHH", 0, 0, 0, 0)))
+    except (IOError, OSError):
+        return None
+    if rows == 0 or columns == 0:
+        return None
+    return rows, columns
+
+
+class ScreenRenderer(object):
+    """Redraws only the rows of the screen that changed, at most max_fps times per second."""
+
+    def __init__(self, output=sys.stdout, max_fps=MAX_FPS, footer=None):
+        self.output = output
+        self.interval = 1.0 / max_fps if max_fps > 0 else 0
+        self.footer = footer  # Returns a line that is always shown at the bottom
+        self.draws = 0
+        self.draw_time = 0.0
+        self._rows = None  # What is on the screen, None if it needs to be cleared
+        self._size = None
+        self._last_draw = 0
+        self._dirty = False
+
+    def update(self, state):
+        """The state has changed, draw it if the rate limit allows, otherwise leave it for later."""
+        self._dirty = True
+        if time.time() - self._last_draw >= self.interval:
+            self.draw(state)
+
+    def flush(self, state):
+        """Input is idle, draw pending changes. Returns how long to wait until they are due, if rate limited."""
+        if not self._dirty:
+            return None
+        remaining = self._last_draw + self.interval - time.time()
+        if remaining > 0:
+            return remaining
+        self.draw(state)
+        return None
+
+    def draw(self, state):
+        start = time.time()
+        rows = state.render()
+
+        size = terminal_size(self.output.fileno())
+        if size != self._size:  # Resized, start over
+            self._size = size
+            self._rows = None
+        if self.footer is not None:
+            if size is not None:
+                rows = rows[:size[0] - 2]
+            rows = rows + [self.footer()]
+        if size is not None:  # Wrapping or scrolling would mess up row positions
+            height, width = size
+            rows = [row[:width] for row in rows[:height - 1]]
+
+        out = []
+        old = self._rows
+        if old is None:
+            out.append("\033[H\033[2J")
+            old = []
+        for i, row in enumerate(rows):
+            if i >= len(old) or old[i] != row:
+                out.append("\033[%d;1H%s\033[K" % (i + 1, row))
+        if len(rows) < len(old):
+            out.append("\033[%d;1H\033[J" % (len(rows) + 1))
+        out.append("\033[%d;1H" % (len(rows) + 1))
+
+        self.output.write("".join(out))
+        self.output.flush()
+        self._rows = rows
+        self._last_draw = time.time()
+        self._dirty = False
+        self.draws += 1
+        self.draw_time += self._last_draw - start
+
+    def metrics(self):
+        return {"draws": self.draws, "seconds": round(self.draw_time, 3)}
+
+
+class DecompressPipe(object):
+    """Streams the output of an external decompressor, for formats without a python module."""
+
+    def __init__(self, command, file_path):
+        self._process = subprocess.Popen(command + [file_path], stdout=subprocess.PIPE)
+
+    def read(self, size):
+        return self._process.stdout.read(size)
+
+    def seek(self, offset):
+        raise IOError(errno.ESPIPE, "Cannot seek in a compressed log")
+
+    def close(self):
+        self._process.stdout.close()
+        self._process.wait()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class BZ2Reader(object):
+    """bz2.BZ2File of python 2 stops at the end of the first stream, logs compressed with pbzip2 or concatenated
+    have many."""
+
+    def __init__(self, file_path):
+        self._file = io.open(file_path, "rb")
+        self._decompressor = bz2.BZ2Decompressor()
+        self._data = ""  # Decompressed but not read yet
+
+    def read(self, size):
+        parts = [self._data]
+        length = len(self._data)
+        while length < size:
+            compressed = self._file.read(CHUNK_SIZE)
+            if not compressed:
+                break
+            while compressed:
+                try:
+                    data = self._decompressor.decompress(compressed)
+                except EOFError:  # The previous stream ended right at the end of the last read
+                    self._decompressor = bz2.BZ2Decompressor()
                     continue
+                parts.append(data)
+                length += len(data)
+                compressed = self._decompressor.unused_data  # The start of the next stream
+                if compressed:
+                    self._decompressor = bz2.BZ2Decompressor()
+        data = "".join(parts)
+        self._data = data[size:]
+        return data[:size]
+
+    def seek(self, offset):
+        raise IOError(errno.ESPIPE, "Cannot seek in a compressed log")
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+_xz = []
+
+
+def xz_command():
+    """The xz binary, for .xz logs when there is no lzma module, None if there is none."""
+    if not _xz:  # Looked up once
+        _xz.append(find_executable("xz"))
+    return _xz[0]
+
+
+def unreadable_logs(file_paths):
+    """The logs that can not be decompressed here."""
+    if lzma is not None or xz_command() is not None:
+        return []
+    return [file_path for file_path in file_paths if file_path.endswith(".xz")]
+
+
+def open_log(file_path):
+    """Open a logfile for reading, compressed logs are decompressed on the fly."""
+    if file_path.endswith(".gz"):
+        return gzip.GzipFile(file_path, "rb")
+    if file_path.endswith(".bz2"):
+        return BZ2Reader(file_path)
+    if file_path.endswith(".xz"):
+        if lzma is not None:
+            return lzma.LZMAFile(file_path, "rb")
+        if xz_command() is None:
+            raise IOError(errno.ENOENT, "No lzma module or xz binary to read", file_path)
+        return DecompressPipe([xz_command(), "--decompress", "--stdout"], file_path)
+    return io.open(file_path, "rb", buffering=0)
 
-            for ls in parsers:
-                if ls.parse(logline, timestamp):
-                    yield ls
 
+ROTATED_SUFFIX = r"\.([0-9]+)(\.gz|\.bz2|\.xz)?$"
+ROTATED = re.compile(ROTATED_SUFFIX)
+
+
+def rotation_of(file_path):
+    """The log that a part like log.2.gz was rotated from, None if it does not look like a rotated part."""
+    m = ROTATED.search(file_path)
+    return file_path[:m.start()] if m is not None else None
+
+
+def rotated_logs(file_path):
+    """The rotated parts of a log (log.3.gz, log.2.gz, log.1, ...), oldest first, without the log itself."""
+    directory, name = os.path.split(file_path)
+    pattern = re.compile(r"^" + re.escape(name) + ROTATED_SUFFIX)
+    parts = []
+    for entry in os.listdir(directory or "."):
+        m = pattern.match(entry)
+        if m is not None:
+            parts.append((int(m.group(1)), os.path.join(directory, entry)))
+    return [path for _, path in sorted(parts, reverse=True)]
+
+
+def read_lines(file_path, seek=0, chunk_size=CHUNK_SIZE):
+    """Read the lines of a logfile in large chunks, for replaying without following the file."""
+    with open_log(file_path) as logfile:
+        if seek:
+            logfile.seek(seek)
+        pending = ""
+        while True:
+            data = logfile.read(chunk_size)
+            if not data:
+                break
+            lines = (pending + data).split("\n")
+            pending = lines.pop()
+            for line in lines:
+                yield line
+        if pending:
+            yield pending
+
+
+def timestamp_key(timestamp):
+    # Both 2016-04-07 13:00:57.468 and 2015-08-03T07:27:10.20Z compare correctly as strings in this form, the Z has
+    # to go before slicing for times given down to the minute, like 2016-04-07T14:03Z
+    return timestamp.rstrip("Z")[:19].replace("T", " ")
+
+
+def log_time(value):
+    """argparse type for times given in the formats used in the logs, for example 2016-04-07T14:03."""
+    if re.match(r"^[0-9]{4}-[0-9]{2}-[0-9]{2}([ T][0-9]{2}:[0-9]{2}(:[0-9]{2}(\.[0-9]*)?)?)?Z?$", value) is None:
+        raise ArgumentTypeError("invalid time {}, expected YYYY-MM-DD[THH:MM[:SS]]".format(value))
+    return value
+
+
+class TimeIndex(object):
+    """Times and offsets of the binf boot markers in a log, cached in a file next to the log."""
+
+    VERSION = 1
+    MARKER = "TOS_NODE_ID"
+    SUFFIX = ".tidx"
+
+    def __init__(self, file_path, simulator=False):
+        self.file_path = file_path
+        self.simulator = simulator
+        self.inode = None
+        self.scanned = 0  # Offset up to which the log has been indexed
+        self.boots = []  # (timestamp key, offset, node address in simulator logs)
+
+    @property
+    def path(self):
+        return self.file_path + self.SUFFIX
+
+    def load(self):
+        try:
+            with open(self.path, "rb") as f:
+                index = json.load(f)
+        except (IOError, ValueError):
+            return
+        if index.get("version") != self.VERSION or index.get("simulator") != self.simulator:
+            return
+        self.inode = index["inode"]
+        self.scanned = index["scanned"]
+        self.boots = [tuple(boot) for boot in index["boots"]]
+
+    def save(self):
+        index = {"version": self.VERSION, "simulator": self.simulator,
+                 "inode": self.inode, "scanned": self.scanned, "boots": self.boots}
+        try:
+            with open(self.path + ".tmp", "wb") as f:
+                json.dump(index, f)
+            os.rename(self.path + ".tmp", self.path)
+        except (IOError, OSError):  # Log directory is not writable, the index is just not cached then
+            pass
+
+    def update(self):
+        """Index whatever has been appended since the last time, or everything if the log has been replaced."""
+        st = os.stat(self.file_path)
+        if st.st_ino != self.inode or st.st_size < self.scanned:
+            self.inode = st.st_ino
+            self.scanned = 0
+            self.boots = []
+        if st.st_size > self.scanned:
+            self._scan()
+            self.save()
+
+    def _scan(self):
+        logparser = LineParser(sim_demux=self.simulator)
+        with io.open(self.file_path, "rb", buffering=0) as logfile:
+            logfile.seek(self.scanned)
+            offset = self.scanned  # Of the start of data
+            pending = ""
+            while True:
+                chunk = logfile.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                data = pending + chunk
+                end = data.rfind("\n") + 1
+                pending = data[end:]
+
+                # Only lines with the marker are looked at, the rest of the chunk is skipped by find
+                pos = data.find(self.MARKER, 0, end)
+                while pos >= 0:
+                    start = data.rfind("\n", 0, pos) + 1
+                    stop = data.find("\n", pos)
+                    status = logparser.parse(data[start:stop])
+                    if isinstance(status, AddressStatus):
+                        self.boots.append((timestamp_key(status.timestamp), offset + start,
+                                           logparser.address if self.simulator else None))
+                    pos = data.find(self.MARKER, stop, end)
+                offset += end
+        self.scanned = offset
+
+    def start_offset(self, target, address=None):
+        """Offset of the last boot before the target time, of the node or of every node that has booted."""
+        nodes = {}
+        for key, offset, node in self.boots:
+            if address is None or node == address:
+                nodes.setdefault(node, ([], []))
+                nodes[node][0].append(key)
+                nodes[node][1].append(offset)
+
+        offsets = []
+        for keys, node_offsets in nodes.itervalues():
+            i = bisect.bisect_right(keys, target)
+            offsets.append(node_offsets[i - 1] if i > 0 else 0)
+        return min(offsets) if offsets else 0
+
+
+class Checkpointer(object):
+    """Periodically saves the states parsed from each log, together with the inode and position in the log."""
+
+    VERSION = 2  # 1 pickled the states as __main__ classes
+
+    def __init__(self, directory, interval=CHECKPOINT_INTERVAL, mode=None):
+        self.directory = directory
+        self.interval = interval
+        self.mode = mode  # Checkpoints made with different parsing options are not used
+        self._last_save = time.time()
+        self._saved = {}  # Logfile: (inode, offset) of the last checkpoint
+
+    def path(self, file_path):
+        return os.path.join(self.directory, os.path.abspath(file_path).strip("/").replace("/", "_") + ".checkpoint")
+
+    def load(self, file_path):
+        """Return the checkpoint of the logfile, if there is one that matches the current file."""
+        try:
+            with open(self.path(file_path), "rb") as f:
+                checkpoint = cPickle.load(f)
+            st = os.stat(file_path)
+        except (IOError, OSError, EOFError, ValueError, TypeError, AttributeError, ImportError, cPickle.UnpicklingError):
+            return None
+
+        if checkpoint.get("version") != self.VERSION or checkpoint.get("mode") != self.mode:
+            return None
+        if checkpoint["inode"] != st.st_ino or checkpoint["offset"] > st.st_size:  # Rotated or truncated since
+            return None
+        self._saved[file_path] = (checkpoint["inode"], checkpoint["offset"])
+        return checkpoint
+
+    def save(self, follower, states):
+        if self._saved.get(follower.file_path) == (follower.inode, follower.offset):
+            return
+
+        timestamps = [timestamp_key(state.timestamp) for state in states.itervalues() if state.timestamp is not None]
+        checkpoint = {"version": self.VERSION, "mode": self.mode,
+                      "inode": follower.inode, "offset": follower.offset, "states": states,
+                      "timestamp": max(timestamps) if timestamps else None}
+        path = self.path(follower.file_path)
+        with open(path + ".tmp", "wb") as f:
+            cPickle.dump(checkpoint, f, cPickle.HIGHEST_PROTOCOL)
+        os.rename(path + ".tmp", path)  # Never leave a half written checkpoint behind
+        self._saved[follower.file_path] = (follower.inode, follower.offset)
+
+    def update(self, followers, dashboard, force=False):
+        now = time.time()
+        if not force and now - self._last_save < self.interval:
+            return
+        self._last_save = now
+
+        for follower in followers:
+            names = dashboard.sources.get(follower.file_path, ())
+            self.save(follower, dict((name, dashboard.states[name]) for name in names))
+
+
+class Metrics(object):
+    """Collects the counters of the followers, the parsers and the renderer, for the footer and for dumps."""
+    FOOTER_PARSERS = 4  # The slowest ones, all of them would not fit
+
+    def __init__(self, registry, renderer=None):
+        self.registry = registry
+        self.renderer = renderer
+        self.followers = []
+        self.started = time.time()
+        self._sample = (self.started, 0)  # Time and line count the rate in the footer is measured from
+        self._rate = 0.0
+
+    def collect(self):
+        metrics = self.registry.metrics()
+        metrics["uptime"] = round(time.time() - self.started, 3)
+        metrics["files"] = dict((follower.file_path, follower.metrics()) for follower in self.followers)
+        if self.renderer is not None:
+            metrics["render"] = self.renderer.metrics()
+        return metrics
+
+    def footer(self):
+        now = time.time()
+        lines = sum(follower.lines for follower in self.followers)
+        then, before = self._sample
+        if now - then >= 1.0:
+            self._rate = (lines - before) / (now - then)
+            self._sample = (now, lines)
+        parsers = sorted(self.registry.parsers(), key=lambda parser: -parser[3])[:self.FOOTER_PARSERS]
+        return "%d lines %.0f/s, %.1f MB in %d reads, lag %d kB, skipped %.1f MB | parse %s, %d unparsed | render %d in %.2fs" % (
+            lines, self._rate, sum(f.bytes_read for f in self.followers) / 1e6, sum(f.reads for f in self.followers),
+            sum(f.lag() for f in self.followers) // 1024, sum(f.bytes_skipped for f in self.followers) / 1e6,
+            " ".join("%s %.2fs" % (cls.__name__, seconds) for cls, _, _, seconds in parsers),
+            self.registry.lines - sum(counter.lines for counter in self.registry.counters.itervalues()),
+            self.renderer.draws if self.renderer is not None else 0,
+            self.renderer.draw_time if self.renderer is not None else 0)
+
+
+def write_profile(profiler, file_path):
+    """Raw stats go next to the report, for pstats or other viewers."""
+    profiler.dump_stats(file_path + ".prof")
+    with open(file_path, "w") as report:
+        stats = pstats.Stats(profiler, stream=report)
+        stats.sort_stats("cumulative").print_stats(40)
+        stats.sort_stats("tottime").print_stats(40)
+
+
+def print_states(states, title, query=None):
+    for name in sorted(states):
+        print "=== {}{} ===".format(title, "" if name is None else " " + name)
+        print states[name] if query is None else "\n".join(states[name].trace(*query))
+        print
+
+
+def read_history(file_path):
+    """Lines of all the rotated parts of a log and then of the log itself."""
+    for path in rotated_logs(file_path) + [file_path]:
+        for line in read_lines(path):
+            yield line
+
+
+def replay(file_path, sim_filter=None, snapshots=(), sim_demux=False, seek=0, states=None, stop=False, history=False,
+           writer=None, diff=True, store=None, query=None, registry=None):
+    """Parse the logfile without rendering, print the state at the snapshot times and at the end, or only the rows of
+    the query. With stop, the replay ends at the last snapshot. With history, the rotated parts are replayed first.
+    With a writer, changes are written out as records instead, or every status if diff is False.
+    Changed rows are also appended to the store, if there is one."""
+    if writer is not None:
+        logparser = LineParser(sim_filter, registry, sim_demux=sim_demux)
+        states = {}
+        for line in read_history(file_path) if history else read_lines(file_path, seek):
+            status = logparser.parse(line)
+            if status is None:
+                continue
+            name = "#" + logparser.address if sim_demux else file_path
+            state = states.get(name)
+            if state is None:
+                state = states[name] = SubsmanagerState()
+            changes = state.update(status)
+            if not diff:
+                writer.write(name, status)
+            elif changes is not None:
+                writer.write(name, status, changes)
+            if store is not None and changes is not None:
+                store.append(store_node(state, logparser.address), status)
+        writer.flush()
+        if store is not None:
+            store.flush()
+        return
+
+    logparser = LineParser(sim_filter, registry, sim_demux=sim_demux)
+    states = {} if states is None else states
+    pending = sorted((timestamp_key(t), t) for t in snapshots)
+    last_timestamp = None
+    for line in read_history(file_path) if history else read_lines(file_path, seek):
+        status = logparser.parse(line)
+        if status is None:
+            continue
+        if pending:
+            key = timestamp_key(status.timestamp)
+            while pending and key > pending[0][0]:
+                print_states(states, pending.pop(0)[1], query)
+            if stop and not pending:
+                return
+
+        name = "#" + logparser.address if sim_demux else None
+        state = states.get(name)
+        if state is None:
+            state = states[name] = SubsmanagerState()
+        if state.update(status) is not None and store is not None:
+            store.append(store_node(state, logparser.address), status)
+        last_timestamp = status.timestamp
+
+    if store is not None:
+        store.flush()
+
+    for _, t in pending:
+        print_states(states, "{} (after end of log)".format(t), query)
+
+    if not stop:
+        print_states(states, "{} (end of log)".format(last_timestamp), query)
+
+
+def replay_at(file_path, at, sim_filter=None, sim_demux=False, checkpointer=None, query=None, registry=None):
+    """Print the state at the given time, replaying only from the last boot or checkpoint before it."""
+    index = TimeIndex(file_path, simulator=sim_filter is not None or sim_demux)
+    index.load()
+    index.update()
+
+    target = timestamp_key(at)
+    address = None if sim_filter is None else "%04X" % int(sim_filter, 16)
+    seek = index.start_offset(target, address)
+    states = None
+
+    if checkpointer is not None and not sim_demux:  # Restarting from a checkpoint only works for single node logs
+        checkpoint = checkpointer.load(file_path)
+        if checkpoint is not None and checkpoint.get("timestamp") is not None \
+                and checkpoint["timestamp"] <= target and checkpoint["offset"] > seek \
+                and file_path in checkpoint["states"]:
+            seek = checkpoint["offset"]
+            states = {None: checkpoint["states"][file_path]}
+
+    replay(file_path, sim_filter=sim_filter, snapshots=(at,), sim_demux=sim_demux, seek=seek, states=states, stop=True,
+           query=query, registry=registry)
+
+
+def expand_filenames(patterns):
+    file_paths = []
+    for pattern in patterns:
+        if glob.has_magic(pattern):  # The time indexes next to the logs are not logs
+            matches = sorted(m for m in glob.glob(pattern) if not m.endswith((TimeIndex.SUFFIX, TimeIndex.SUFFIX + ".tmp")))
+            # Neither are the rotated parts of a log that is matched too, those are read with --history
+            matched = set(matches)
+            matches = [m for m in matches if rotation_of(m) not in matched]
         else:
-            time.sleep(INTERVAL)
-            logfile.seek(where)
+            matches = [pattern]
+        for file_path in matches:
+            if file_path not in file_paths:
+                file_paths.append(file_path)
+    return file_paths
 
 
 def main():
     from argparse import ArgumentParser
     parser = ArgumentParser(description="Statusparser")
-    parser.add_argument("filename")
+    parser.add_argument("filenames", nargs="+", metavar="filename", help="Logfiles or glob patterns, all are followed at once")
     parser.add_argument("--old", action="store_true")
     parser.add_argument("--sim-filter", default=None, help="Use simulation log, specify node address to filter, hex!")
+    parser.add_argument("--sim-demux", action="store_true", help="Use simulation log, show every node separately")
+    parser.add_argument("--fps", default=MAX_FPS, type=float, help="Maximum screen refresh rate, 0 for no limit")
+    parser.add_argument("--replay", action="store_true", help="Parse the whole file without following it and print the final state")
+    parser.add_argument("--history", action="store_true", help="Start with the rotated and compressed parts of the logs (log.2.gz, log.1, ...)")
+    parser.add_argument("--output", default=None, choices=("jsonl", "binary"), help="Write a record for every status instead of showing the tables, binary is JSON with a 4 byte length prefix")
+    parser.add_argument("--output-file", default="-", help="Where --output records go")
+    parser.add_argument("--serve", default=None, type=listen_address, metavar="[HOST:]PORT", help="Also serve the state over HTTP, GET /state for a JSON snapshot, GET /events for a stream of changes. The screen is not drawn if stdout is not a terminal")
+    parser.add_argument("--allow-origin", default=None, metavar="ORIGIN", help="Let pages from ORIGIN (or * for any) read the state served with --serve")
+    parser.add_argument("--no-diff", action="store_true", help="Write a full --output record for every parsed status, not just for changes")
+    parser.add_argument("--checkpoint-dir", default=None, help="Periodically save the state here and resume from it when started again")
+    parser.add_argument("--checkpoint-interval", default=CHECKPOINT_INTERVAL, type=float, help="Seconds between checkpoints")
+    parser.add_argument("--at", default=None, type=log_time, help="Print the state at this time, replaying only from the last boot before it")
+    parser.add_argument("--snapshot", default=[], action="append", type=log_time, help="With --replay, also print the state at this time, for example 2016-04-07T14:03")
+    parser.add_argument("--max-lag", default=None, type=size_value, metavar="SIZE", help="When following falls more than this far behind the end of the log, 16M for example, jump to the last complete dump cycle or boot instead of parsing everything. Should be larger than two dump cycles of all the nodes")
+    parser.add_argument("--store", default=None, metavar="DIR", help="Append the stream, provider and registry counters to column files here, for query_subsmanager_store.py")
+    parser.add_argument("--stats", action="store_true", help="Count lines, reads and time spent per status class, show them in a footer while following, on /metrics with --serve and on stderr at exit, also with --replay and --at")
+    query = parser.add_mutually_exclusive_group()
+    query.add_argument("--mote", default=None, help="Show only the registry entry, streams and providers of this mote, 02 for example")
+    query.add_argument("--cid", default=None, help="Show only the streams, middleware and providers of this cid, hex, 834e for example")
+    query.add_argument("--guid", default=None, help="Show only the registry entry, streams and providers of the mote with this GUID")
+    parser.add_argument("--profile", default=None, metavar="REPORT", help="Run under cProfile and write a report here, raw stats to REPORT.prof")
     args = parser.parse_args()
 
-    logfile = None
+    if args.profile is None:
+        run(parser, args)
+        return
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.runcall(run, parser, args)
+    finally:
+        write_profile(profiler, args.profile)
+
+
+def run(parser, args):
+    file_paths = expand_filenames(args.filenames)
+    if not file_paths:
+        parser.error("no files match {}".format(" ".join(args.filenames)))
+    unreadable = unreadable_logs(file_paths + ([path for file_path in file_paths for path in rotated_logs(file_path)]
+                                               if args.history else []))
+    if unreadable:
+        parser.error("no lzma module or xz binary to read {}".format(" ".join(unreadable)))
+    if args.output is not None and (args.at is not None or args.snapshot):
+        parser.error("--at and --snapshot print tables, they can not be combined with --output")
+
+    checkpointer = None
+    if args.checkpoint_dir is not None:
+        if not os.path.isdir(args.checkpoint_dir):
+            os.makedirs(args.checkpoint_dir)
+        checkpointer = Checkpointer(args.checkpoint_dir, args.checkpoint_interval, mode=(args.sim_filter, args.sim_demux))
+
+    writer = None
+    if args.output is not None:
+        output = sys.stdout if args.output_file == "-" else open(args.output_file, "ab")
+        writer = RecordWriter(output, binary=args.output == "binary")
+
+    store = HistoryStore(args.store) if args.store is not None else None
+
+    query = None
+    for field in ("mote", "cid", "guid"):
+        if getattr(args, field) is not None:
+            try:
+                query = (field, query_value(field, getattr(args, field)))
+            except ValueError:
+                parser.error("bad --{} {}".format(field, getattr(args, field)))
+
+    if args.at is not None or args.replay:
+        registry = CountingRegistry() if args.stats else None
+        metrics = Metrics(registry) if args.stats else None
+        for file_path in file_paths:
+            if len(file_paths) > 1 and writer is None:
+                print "##### {} #####".format(file_path)
+            if args.at is not None:
+                replay_at(file_path, args.at, sim_filter=args.sim_filter, sim_demux=args.sim_demux,
+                          checkpointer=checkpointer, query=query, registry=registry)
+            else:
+                replay(file_path, sim_filter=args.sim_filter, snapshots=args.snapshot, sim_demux=args.sim_demux,
+                       history=args.history, writer=writer, diff=not args.no_diff, store=store, query=query,
+                       registry=registry)
+        if metrics is not None:
+            sys.stderr.write(json.dumps(metrics.collect(), indent=2, sort_keys=True) + "\n")
+        return
+
+    server = None
+    if args.serve is not None:
+        server = StatusServer(args.serve, None, allow_origin=args.allow_origin)
+
+    show = writer is None and (server is None or sys.stdout.isatty())
+    terminal_settings = None
+    if sys.stdin.isatty() and show:  # Read keys for switching between logs without waiting for enter
+        terminal_settings = termios.tcgetattr(sys.stdin.fileno())
+        tty.setcbreak(sys.stdin.fileno())
+
+    def state_name(file_path):
+        if not args.sim_demux:
+            return file_path
+        if len(file_paths) == 1:
+            return "#" + logparser.address
+        return "{} #{}".format(file_path, logparser.address)
+
+    written = {}  # file_path: (inode, position) of the last record written, a retry does not write them again
+
+    def unwritten(file_path, inode, position):
+        last = written.get(file_path)
+        if last is not None and last[0] == inode and position <= last[1]:
+            return False
+        written[file_path] = (inode, position)
+        return True
+
+    dashboard = follower = logparser = metrics = None
     try:
         while True:
             try:
-                if args.old:
-                    file_size = 0
-                else:
-                    file_size = os.stat(args.filename)[6]
-
-                addr = AddressStatus()
-                managermap = {0: ManagerStatus(0)}
-                streammap = {0: StreamStatus(0)}
-                middlewaremap = {0: MiddlewareStatus(0)}
-                middlewareproviders = {}
-                schedulermap = {0: SchedulerStatus(0)}
-                registrystatus = {0: RegistryStatus(0)}
-                outputstatus = OutputStatus()
-                inputstatus = InputStatus()
-                for status in tail_file(args.filename, seek=file_size, sim_filter=args.sim_filter):
-                    if isinstance(status, ManagerStatus):
-                        managermap[status.index] = status
-                    if isinstance(status, StreamStatus):
-                        streammap[status.index] = status
-                    elif isinstance(status, MiddlewareStatus):
-                        middlewaremap[status.index] = status
-                    elif isinstance(status, MiddlewareProviderStatus):
-                        if status.index not in middlewareproviders:
-                            middlewareproviders[status.index] = {}
-                        if status.live:
-                            middlewareproviders[status.index][status.mote] = status
-                        else:
-                            middlewareproviders[status.index].pop(status.mote, None)
-                    elif isinstance(status, SchedulerStatus):
-                        schedulermap[status.index] = status
-                    elif isinstance(status, RegistryStatus):
-                        registrystatus[status.index] = status
-                    elif isinstance(status, AddressStatus):
-                        addr = status
-                        managermap = {0: ManagerStatus(0)}
-                        streammap = {0: StreamStatus(0)}
-                        middlewaremap = {0: MiddlewareStatus(0)}
-                        middlewareproviders = {}
-                        schedulermap = {0: SchedulerStatus(0)}
-                        registrystatus = {0: RegistryStatus(0)}
-                        outputstatus = OutputStatus()
-                        inputstatus = InputStatus()
-                    elif isinstance(status, OutputStatus):
-                        outputstatus = status
-                    elif isinstance(status, InputStatus):
-                        inputstatus = status
-
-                    print "\033c"  # clear screen
-                    print addr
-                    print
-
-                    print ManagerStatus()
-                    for i in xrange(0, max(managermap.iterkeys())+1):
-                        if i not in managermap:
-                            managermap[i] = ManagerStatus(i)
-                        print managermap[i]
-
-                    print
-                    print StreamStatus()
-                    for i in xrange(0, max(streammap.iterkeys())+1):
-                        if i not in streammap:
-                            streammap[i] = StreamStatus(i)
-                        print streammap[i]
-
-                    print
-                    print MiddlewareStatus()
-                    previous_had_providers = False
-                    for i in xrange(0, max(middlewaremap.iterkeys())+1):
-                        if i in middlewaremap:
-                            if previous_had_providers:
-                                print
-                                print MiddlewareStatus()
-                            print middlewaremap[i]
-                            if i in middlewareproviders:
-                                if len(middlewareproviders[i]) > 0:
-                                    print MiddlewareProviderStatus()
-                                    for k in sorted(middlewareproviders[i].keys()):
-                                        print middlewareproviders[i][k]
-                                    previous_had_providers = True
-                                    continue
-                                else:
-                                    del middlewareproviders[i]
-
-                        previous_had_providers = False
-
-                    print
-                    print SchedulerStatus()
-                    for i in xrange(0, max(schedulermap.iterkeys())+1):
-                        if i not in schedulermap:
-                            schedulermap[i] = SchedulerStatus(i)
-                        print schedulermap[i]
-
-                    print
-                    print RegistryStatus()
-                    for i in xrange(0, max(registrystatus.iterkeys())+1):
-                        if i not in registrystatus:
-                            registrystatus[i] = RegistryStatus(i)
-                        print registrystatus[i]
-
-                    print
-                    print "Output {}".format(outputstatus)
-                    print "Input  {}".format(inputstatus)
+                dashboard = Dashboard([] if args.sim_demux else file_paths)
+                dashboard.query = query
+                renderer = ScreenRenderer(max_fps=args.fps)
+                registry = None
+                if args.stats:
+                    registry = CountingRegistry()
+                    metrics = Metrics(registry, renderer if show else None)
+                    renderer.footer = metrics.footer
+                logparser = LineParser(args.sim_filter, registry, sim_demux=args.sim_demux)
+                if server is not None:
+                    server.dashboard = dashboard
+                    server.metrics = metrics.collect if metrics is not None else None
+
+                seeks = {}
+                if checkpointer is not None and not args.old:
+                    for file_path in file_paths:
+                        checkpoint = checkpointer.load(file_path)
+                        if checkpoint is not None:
+                            seeks[file_path] = checkpoint["offset"]
+                            for name, state in checkpoint["states"].iteritems():
+                                dashboard.add(name, file_path, state)
+
+                if args.history:  # Rebuild from the rotated parts, then follow the current file from its start
+                    for file_path in file_paths:
+                        if file_path in seeks:
+                            continue
+                        for path in rotated_logs(file_path):
+                            for i, status in enumerate(parse_lines(read_lines(path), parser=logparser)):
+                                name = state_name(file_path)
+                                changes = dashboard.update(name, status, file_path)
+                                if writer is not None and (changes is not None or args.no_diff) \
+                                        and unwritten(path, None, i):
+                                    writer.write(name, status, None if args.no_diff else changes)
+                                if store is not None and changes is not None:
+                                    store.append(store_node(dashboard.states[name], logparser.address), status)
+                        seeks[file_path] = 0
+
+                def on_idle():
+                    if checkpointer is not None:
+                        checkpointer.update(follower.followers, dashboard)
+                    if writer is not None:
+                        writer.flush()
+                    if store is not None:
+                        store.flush()
+                    if not show:
+                        return None
+                    return renderer.flush(dashboard)
+
+                def on_error(file_path, e):
+                    # Only this file is retried, the others are followed meanwhile
+                    if e is None:
+                        dashboard.errors.pop(file_path, None)
+                    else:
+                        dashboard.errors[file_path] = str(e)
+                    if show:
+                        renderer.update(dashboard)
+                    elif e is not None:
+                        sys.stderr.write("Error: {}, retrying\n".format(e))
+
+                follower = MultiLogFollower(file_paths, seek_to_end=not args.old, seeks=seeks, on_idle=on_idle,
+                                            max_lag=args.max_lag, on_error=on_error)
+                if metrics is not None:
+                    metrics.followers = follower.followers
+                if server is not None:
+                    server.on_error = lambda e: on_error("--serve", e)
+                    server.attach(follower.readers, follower.writers)
+
+                def read_key():
+                    key = os.read(sys.stdin.fileno(), 1)
+                    if not key:  # Closed
+                        del follower.readers[sys.stdin.fileno()]
+                        return
+                    dashboard.key(key)
+                    renderer.update(dashboard)
+
+                if terminal_settings is not None:
+                    follower.readers[sys.stdin.fileno()] = read_key
+
+                if seeks and show:  # Show what was restored right away
+                    renderer.update(dashboard)
+
+                for source, line in follower:
+                    status = logparser.parse(line)
+                    if status is not None:
+                        name = state_name(source.file_path)
+                        changes = dashboard.update(name, status, source.file_path)
+                        if writer is not None and (changes is not None or args.no_diff) \
+                                and unwritten(source.file_path, source.inode, source.offset):
+                            writer.write(name, status, None if args.no_diff else changes)
+                        if changes is not None:
+                            if store is not None:
+                                store.append(store_node(dashboard.states[name], logparser.address), status)
+                            if server is not None:
+                                server.publish(name, status, changes)
+                            if show and dashboard.visible(name):
+                                renderer.update(dashboard)
+                    if checkpointer is not None:
+                        checkpointer.update(follower.followers, dashboard)
             except (OSError, IOError) as e:
+                if follower is not None:
+                    follower.close()
+                    follower = None
+                if e.errno == errno.EPIPE:  # Whoever was reading the output is gone
+                    return
+                if writer is not None:  # What was parsed before the error is not written again
+                    writer.flush()
+                if not show:
+                    sys.stderr.write("Error: {}\n".format(e))
+                    time.sleep(1)
+                    continue
                 print "\033c"  # clear screen
                 print "Error:", str(e)
                 time.sleep(1)
 
     except KeyboardInterrupt:
+        if checkpointer is not None and follower is not None:
+            checkpointer.update(follower.followers, dashboard, force=True)
+        if store is not None:
+            store.flush()
+        if metrics is not None:
+            sys.stderr.write(json.dumps(metrics.collect(), indent=2, sort_keys=True) + "\n")
+        if writer is not None:
+            writer.flush()
+        if not show:
+            return
         print "interrupted"
-        if logfile is not None:
-            logfile.close()
         sys.stdout.flush()
+    finally:
+        if follower is not None:
+            follower.close()
+        if server is not None:
+            server.close()
+        if terminal_settings is not None:
+            termios.tcsetattr(sys.stdin.fileno(), termios.TCSADRAIN, terminal_settings)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # Run from the module, so that checkpoints pickle tail_subsmanager.* and not __main__.*, which only loads in the script
+    import tail_subsmanager
+    tail_subsmanager.main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python2
+"""test_incoming_data_receiver.py: Tests for incoming_data_receiver, run with python2 -m unittest discover"""
+import unittest
+
+from incoming_data_receiver import BulkParser
+
+__author__ = "Raido Pahtma"
+__license__ = "MIT"
+
+
+class ListSink(object):
+
+    def __init__(self):
+        self.records = []
+
+    def valid(self, data):
+        return True
+
+    def put(self, header, data):
+        self.records.append(data)
+        return True
+
+
+class BulkParserTest(unittest.TestCase):
+
+    def split(self, body, size, lines=False):
+        """The records of a body fed size bytes at a time."""
+        sink = ListSink()
+        parser = BulkParser(sink, None, lines)
+        for i in xrange(0, len(body), size):
+            parser.feed(body[i:i + size])
+        self.assertTrue(parser.finish(), "%s in %d byte chunks: %s" % (body, size, parser.error))
+        return sink.records
+
+    def assertSplits(self, body, records, lines=False):
+        for size in xrange(1, len(body) + 1):
+            self.assertEqual(self.split(body, size, lines), records, "%d byte chunks" % size)
+
+    def test_escapes(self):
+        self.assertSplits(b'[1, "a\\\\", 2]', [b'1', b'"a\\\\"', b'2'])
+        self.assertSplits(b'["a\\"]", "\\\\\\"", "\\\\\\\\"]', [b'"a\\"]"', b'"\\\\\\""', b'"\\\\\\\\"'])
+        self.assertSplits(b'{"a": "\\\\"}\n{"b": "\\""}\n', [b'{"a": "\\\\"}', b'{"b": "\\""}'])
+
+    def test_nested_arrays(self):
+        self.assertSplits(b' [[1, [2, 3]], {"a": [4, "]"]}, "x,y", []]',
+                          [b'[1, [2, 3]]', b'{"a": [4, "]"]}', b'"x,y"', b'[]'])
+        self.assertSplits(b'[]', [])
+
+    def test_ndjson_arrays(self):
+        self.assertSplits(b'[67, {}]\n[1]\n', [b'[67, {}]', b'[1]'], lines=True)
+        self.assertSplits(b'{"a": 1}\n\n[2, "\\n"]', [b'{"a": 1}', b'[2, "\\n"]'], lines=True)
+
+    def test_errors(self):
+        sink = ListSink()
+        parser = BulkParser(sink, None)
+        parser.feed(b'[1, "a\\\\')
+        parser.feed(b'", 2')
+        self.assertFalse(parser.finish())
+        self.assertEqual(parser.error, "incomplete array")
+        self.assertEqual(sink.records, [b'1', b'"a\\\\"'])
+
+        parser = BulkParser(ListSink(), None)
+        parser.feed(b'[1] 2')
+        self.assertFalse(parser.finish())
+        self.assertEqual(parser.error, "data after the array")
+
+
+if __name__ == "__main__":
+    unittest.main()
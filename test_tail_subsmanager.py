@@ -0,0 +1,230 @@
+#!/usr/bin/env python2
+"""test_tail_subsmanager.py: Tests for tail_subsmanager, run with python2 -m unittest discover"""
+import bz2
+import os
+import shutil
+import tempfile
+import unittest
+
+import tail_subsmanager
+from gen_subsmanager_log import LogGenerator
+from tail_subsmanager import Dashboard, LineParser, AddressStatus, SubsmanagerState, CorrelationIndex
+from tail_subsmanager import MultiLogFollower, timestamp_key, expand_filenames, read_lines, restart_offset
+
+__author__ = "Raido Pahtma"
+__license__ = "MIT"
+
+
+SIM_LINES = [
+    "0:00:01.000000000 DEBUG (1): 2016-10-26 12:00:00 00:00:01.000000000 #0001 I|binf:  22|TOS_NODE_ID 0001 GUID 01A2EE0E 15000001",
+    "0:00:01.000000000 DEBUG (2): 2016-10-26 12:00:00 00:00:01.000000000 #0002 I|binf:  22|TOS_NODE_ID 0002 GUID 01A2EE0E 15000002",
+    "0:00:02.000000000 DEBUG (1): 2016-10-26 12:00:01 00:00:02.000000000 #0001 D|sbslog:  23|s[00] p0 l33 (1|0) 0/3600 (1)",
+]
+
+
+class DashboardTest(unittest.TestCase):
+
+    def test_first_status_of_a_new_node_is_applied(self):
+        dashboard = Dashboard()
+        logparser = LineParser(sim_demux=True)
+        for line in SIM_LINES:
+            status = logparser.parse(line)
+            changes = dashboard.update("#" + logparser.address, status, "sim.log")
+            if isinstance(status, AddressStatus):
+                self.assertEqual(changes, ["addr", "boot"])
+
+        self.assertIsNone(dashboard.selected)  # The summary
+        self.assertEqual(dashboard.names, ["#0001", "#0002"])
+        self.assertEqual(dashboard.states["#0001"].addr.addr, 0x0001)
+        self.assertEqual(dashboard.states["#0002"].addr.addr, 0x0002)
+        self.assertEqual(dashboard.states["#0001"].managermap[0].len, 33)
+        self.assertEqual(dashboard.sources, {"sim.log": ["#0001", "#0002"]})
+
+
+def scan(state):
+    """The correlation index of a state the slow way, from every row of the tables."""
+    index = CorrelationIndex()
+    for row in state.streammap.itervalues():
+        if row.mote is not None:
+            index.mote_streams.setdefault(row.mote, set()).add(row.index)
+        if row.cid is not None:
+            index.cid_streams.setdefault(row.cid, set()).add(row.index)
+    for row in state.middlewaremap.itervalues():
+        if row.cid is not None:
+            index.cid_middleware.setdefault(row.cid, set()).add(row.index)
+    for i, providers in state.middlewareproviders.iteritems():
+        for row in providers.itervalues():
+            if row.live:
+                index.mote_providers.setdefault(row.mote, set()).add(i)
+    for row in state.registrystatus.itervalues():
+        if row.guid is not None:
+            index.guid_registry.setdefault(row.guid, set()).add(row.index)
+    return index
+
+
+class CorrelationTest(unittest.TestCase):
+
+    def changed_log(self):
+        """Dump cycles of a node, with streams and a middleware switching to another mote or cid, a provider going
+        away and a mote registering with another GUID in between, the next cycle switches them back. Returns the lines
+        and the range of the changes."""
+        generator = LogGenerator(seed=3, reboot=0)
+        cycles = generator.cycles()
+        lines = []
+        changes = None
+        for i in xrange(20):
+            lines.extend(next(cycles))
+            if i == 5:
+                node = generator.nodes[0]
+                changes = len(lines)
+                lines.append(generator.line(node, "D", "sbslog", "t[00|00] m07:9000(0)(1|0) 14/0/3/4 5~6"))
+                lines.append(generator.line(node, "D", "sbslog", "t[01|00] m07:834f(1)(1|0) 14/0/3/4 5~6"))
+                lines.append(generator.line(node, "D", "sbslog", "t[02|01] m03:9001(2)(1|0) 14/0/3/4 5~6"))
+                lines.append(generator.line(node, "D", "mddl", "[00] s1 i9000 p0 c3 1/2/3/4"))
+                lines.append(generator.line(node, "D", "mddl", "[01] m03 --"))
+                lines.append(generator.line(node, "D", "mreg", "m00 0002 c1 t1 01A2EE0E 15000099"))
+                changes = (changes, len(lines))
+        return lines, changes
+
+    def test_index_matches_the_tables(self):
+        logparser = LineParser()
+        state = SubsmanagerState()
+        traced = set()
+        lines, changes = self.changed_log()
+        for i, line in enumerate(lines):
+            if i == changes[0]:
+                self.assertIn(1, state.correlation.mote_providers[3])
+            elif i == changes[1]:
+                self.assertEqual(state.correlation.mote_streams[7], set([0, 1]))
+                self.assertNotIn(0x834e, state.correlation.cid_streams)
+                self.assertEqual(state.correlation.cid_streams[0x9001], set([2]))
+                self.assertEqual(state.correlation.mote_streams[3], set([2, 7]))
+                self.assertEqual(state.correlation.cid_middleware[0x9000], set([0]))
+                self.assertNotIn(1, state.correlation.mote_providers[3])
+                self.assertEqual(state.correlation.guid_registry["01A2EE0E15000099"], set([0]))
+
+            status = logparser.parse(line)
+            if status is None:
+                continue
+            state.update(status)
+
+            expected = scan(state)
+            index = state.correlation
+            self.assertEqual(index.mote_streams, expected.mote_streams)
+            self.assertEqual(index.mote_providers, expected.mote_providers)
+            self.assertEqual(index.cid_streams, expected.cid_streams)
+            self.assertEqual(index.cid_middleware, expected.cid_middleware)
+            self.assertEqual(index.guid_registry, expected.guid_registry)
+
+            # Values that were indexed before are traced too, they must come up empty once nothing refers to them
+            traced.update(("mote", mote) for mote in index.mote_streams.keys() + index.mote_providers.keys())
+            traced.update(("cid", cid) for cid in index.cid_streams.keys() + index.cid_middleware.keys())
+            traced.update(("guid", guid) for guid in index.guid_registry)
+            for field, value in traced:  # The first line has the uptime, which goes on with the clock
+                trace = state.trace(field, value)[1:]
+                state.correlation = expected
+                self.assertEqual(trace, state.trace(field, value)[1:])
+                state.correlation = index
+
+        self.assertNotIn(7, state.correlation.mote_streams)
+        self.assertNotIn(0x9000, state.correlation.cid_middleware)
+        self.assertNotIn(0x9001, state.correlation.cid_streams)
+        self.assertNotIn("01A2EE0E15000099", state.correlation.guid_registry)
+
+
+class TimeTest(unittest.TestCase):
+
+    def test_timestamp_key(self):
+        self.assertEqual(timestamp_key("2016-04-07 13:00:57.468"), "2016-04-07 13:00:57")
+        self.assertEqual(timestamp_key("2015-08-03T07:27:10.20Z"), "2015-08-03 07:27:10")
+        self.assertEqual(timestamp_key("2016-04-07T14:03Z"), "2016-04-07 14:03")
+        self.assertEqual(timestamp_key("2016-04-07Z"), "2016-04-07")
+        self.assertLess(timestamp_key("2016-04-07T14:03Z"), timestamp_key("2016-04-07 14:03:00.001"))
+
+
+class FilenameTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def touch(self, *names):
+        for name in names:
+            open(os.path.join(self.directory, name), "w").close()
+
+    def test_time_index_is_not_a_log(self):
+        self.touch("log", "log.tidx", "other.log", "other.log.tidx.tmp")
+        self.assertEqual(expand_filenames([os.path.join(self.directory, "*")]),
+                         [os.path.join(self.directory, name) for name in ("log", "other.log")])
+
+    def test_rotated_parts_are_not_logs(self):
+        self.touch("log", "log.1", "log.2.gz", "log.3.bz2", "other.log.1")
+        self.assertEqual(expand_filenames([os.path.join(self.directory, "*")]),
+                         [os.path.join(self.directory, name) for name in ("log", "other.log.1")])
+        self.assertEqual(expand_filenames([os.path.join(self.directory, "log.1")]),
+                         [os.path.join(self.directory, "log.1")])
+
+    def test_multi_stream_bz2(self):
+        with open(os.path.join(self.directory, "log.1.bz2"), "wb") as f:
+            for part in (SIM_LINES[:2], SIM_LINES[2:]):
+                f.write(bz2.compress("".join(line + "\n" for line in part)))
+        self.assertEqual(list(read_lines(os.path.join(self.directory, "log.1.bz2"))), SIM_LINES)
+
+
+
+class FollowerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.chunk_size = tail_subsmanager.CHUNK_SIZE
+        tail_subsmanager.CHUNK_SIZE = 1024  # So that a small log takes many reads
+
+    def tearDown(self):
+        tail_subsmanager.CHUNK_SIZE = self.chunk_size
+        shutil.rmtree(self.directory)
+
+    def test_busy_log_does_not_starve_a_quiet_one(self):
+        busy = os.path.join(self.directory, "busy.log")
+        quiet = os.path.join(self.directory, "quiet.log")
+        with open(busy, "w") as f:
+            for i in xrange(1000):
+                f.write(SIM_LINES[2] + "\n")
+        open(quiet, "w").close()
+
+        follower = MultiLogFollower([busy, quiet])
+        busy_lines = 0
+        try:
+            for source, line in follower:
+                if source.file_path == quiet:
+                    self.assertEqual(line, "appended")
+                    break
+                if busy_lines == 100:  # Both have been read by now
+                    with open(quiet, "a") as f:
+                        f.write("appended\n")
+                busy_lines += 1
+                self.assertLess(busy_lines, 1000, "the quiet log was only read once the busy one was done")
+        finally:
+            follower.close()
+
+    def test_restart_offset(self):
+        path = os.path.join(self.directory, "sim.log")
+        other = SIM_LINES[2].replace("#0001", "#0002")
+        lines = [SIM_LINES[2]] * 50 + [other] + [SIM_LINES[2]] * 50 + [other]
+        with open(path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        length = len(SIM_LINES[2]) + 1
+        end = os.path.getsize(path)
+
+        # Both have two cycles, #0002 has the older second last one
+        self.assertEqual(restart_offset(path, end, end), 50 * length)
+        # #0002 has one cycle in the window, so it is searched from the first line
+        self.assertEqual(restart_offset(path, end, end - 60 * length - 5), 61 * length)
+        self.assertEqual(restart_offset(path, end, 40 * length + 5), end - 40 * length)
+        # The incomplete last line is not looked at
+        self.assertEqual(restart_offset(path, end - 1, end), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()